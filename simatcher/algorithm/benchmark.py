@@ -0,0 +1,129 @@
+import time
+from typing import List, Dict, Text
+
+import numpy as np
+
+import faiss
+
+from simatcher.algorithm.beta import SentenceFaiss, INDEX_TYPES, INDEX_FLAT, INDEX_NUMPY, STORAGE_CODES
+from simatcher.common.cache import encode_vector, decode_vector
+
+"""
+Recall / latency trade off of the SentenceFaiss index types on random embeddings.
+python -m simatcher.algorithm.benchmark
+PQ training dominates the run time on a single core.
+`compare_storage` measures memory and top k agreement of compressed vectors against float32.
+`calibrate_numpy_limit` measures the pool size up to which numpy beats faiss flat search,
+it is the source of NUMPY_SEARCH_LIMIT.
+"""
+
+
+def random_pool(size: int, dimension: int, seed: int = 0) -> np.ndarray:
+    # clustered points, closer to sentence embeddings than uniform noise
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(max(1, size // 100), dimension).astype(np.float32)
+    labels = rng.randint(0, len(centers), size)
+    return centers[labels] + 0.3 * rng.randn(size, dimension).astype(np.float32)
+
+
+def compare_index_types(size: int,
+                        dimension: int = 768,
+                        queries: int = 200,
+                        top_k: int = 5,
+                        index_types: List[Text] = None,
+                        **index_params) -> List[Dict]:
+    pool = random_pool(size, dimension)
+    query = random_pool(queries, dimension, seed=1)
+    reports = []
+    for index_type in index_types or INDEX_TYPES:
+        sf = build_index(pool, index_type, **index_params)
+        reports.append(dict(sf.evaluate(query, pool, top_k), size=size))
+    return reports
+
+
+def top_k_agreement(found: np.ndarray, expected: np.ndarray) -> float:
+    return sum(len(set(f) & set(e)) for f, e in zip(found, expected)) / expected.size
+
+
+def compare_storage(size: int,
+                    dimension: int = 768,
+                    queries: int = 200,
+                    top_k: int = 5,
+                    index_type: Text = INDEX_FLAT) -> List[Dict]:
+    """
+    index: faiss scalar quantized index vectors
+    cache: embedding cache codec, vectors decoded to float32 before indexing
+    agreement: share of the float32 top k kept
+    """
+    pool = random_pool(size, dimension)
+    query = random_pool(queries, dimension, seed=1)
+    truth = build_index(pool, index_type).search_batch(query, top_k)['ann']
+    reports = []
+    for storage in STORAGE_CODES:
+        sf = build_index(pool, index_type, storage=storage)
+        reports.append({
+            'storage': f'index {storage}',
+            'bytes': faiss.serialize_index(sf.faiss_index).nbytes,
+            'agreement': top_k_agreement(sf.search_batch(query, top_k)['ann'], truth),
+        })
+    for dtype in ('float16', 'int8'):
+        encoded = [encode_vector(vector, dtype) for vector in pool]
+        decoded = np.vstack([decode_vector(*value) for value in encoded])
+        reports.append({
+            'storage': f'cache {dtype}',
+            'bytes': sum(codes.nbytes for codes, _ in encoded),
+            'agreement': top_k_agreement(build_index(decoded, index_type).search_batch(query, top_k)['ann'], truth),
+        })
+    return reports
+
+
+def build_index(pool: np.ndarray, index_type: Text, **index_params) -> SentenceFaiss:
+    sf = SentenceFaiss(pool, index_type=index_type, **index_params)
+    sf.train()
+    return sf
+
+
+def search_latency(sf: SentenceFaiss, queries: np.ndarray, top_k: int = 5) -> float:
+    """ms per single query search, the request path of the classifier"""
+    start = time.perf_counter()
+    for query in queries:
+        sf.search_batch(query, top_k)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def calibrate_numpy_limit(sizes: List[int] = (64, 128, 256, 512, 1024, 2048, 4096, 8192),
+                          dimension: int = 768,
+                          queries: int = 200) -> Dict:
+    """Latency of numpy and faiss flat search by pool size, limit: largest size numpy wins."""
+    query = random_pool(queries, dimension, seed=1)
+    latencies, limit = [], 0
+    for size in sizes:
+        pool = random_pool(size, dimension)
+        numpy_ms, flat_ms = [search_latency(build_index(pool, index_type), query)
+                             for index_type in (INDEX_NUMPY, INDEX_FLAT)]
+        latencies.append({'size': size, 'numpy_ms': numpy_ms, 'flat_ms': flat_ms})
+        if numpy_ms < flat_ms:
+            limit = size
+    return {'limit': limit, 'latencies': latencies}
+
+
+def main(sizes: List[int] = (1000, 10000), dimension: int = 256):
+    print(f'{"size":>8} {"index":>16} {"recall":>8} {"ms/query":>10} {"exact ms":>10}')
+    for size in sizes:
+        for report in compare_index_types(size, dimension):
+            print(f'{report["size"]:>8} {report["index"]:>16} {report["recall"]:>8.3f} '
+                  f'{report["latency_ms"]:>10.4f} {report["exact_latency_ms"]:>10.4f}')
+
+    print(f'\n{"storage":>16} {"bytes":>12} {"agreement":>10}')
+    for report in compare_storage(sizes[0], dimension):
+        print(f'{report["storage"]:>16} {report["bytes"]:>12} {report["agreement"]:>10.3f}')
+
+    calibration = calibrate_numpy_limit(dimension=dimension)
+    print(f'\n{"size":>8} {"numpy ms":>10} {"flat ms":>10}')
+    for latency in calibration['latencies']:
+        print(f'{latency["size"]:>8} {latency["numpy_ms"]:>10.4f} {latency["flat_ms"]:>10.4f}')
+    print(f'NUMPY_SEARCH_LIMIT: {calibration["limit"]}')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,593 @@
-from typing import Union, List, Dict
+import os
+import time
+import math
+from typing import Union, List, Dict, Optional, Text, Iterable, Tuple
 
 import faiss
 import numpy as np
 from torch import Tensor
 
+from simatcher.log import logger
+from simatcher.common.io import create_dir, write_json_to_file, read_json_file
+from simatcher.common.locks import RWLock
+
 """
 before: embedding
 input: query[List], pool[List[List]]
 output: item[Union[List, Dict]]
 """
 
+INDEX_AUTO = 'auto'
+INDEX_FLAT = 'flat'
+INDEX_IVF_FLAT = 'ivf_flat'
+INDEX_HNSW = 'hnsw'
+INDEX_IVF_PQ = 'ivf_pq'
+# flat storage searched by a numpy matmul, no faiss call overhead on small pools
+INDEX_NUMPY = 'numpy'
+INDEX_TYPES = [INDEX_FLAT, INDEX_IVF_FLAT, INDEX_HNSW, INDEX_IVF_PQ, INDEX_NUMPY]
+
+# l2: distances of unit vectors, lower is better
+# cosine: inner product of unit vectors, similarity scores, higher is better
+METRIC_L2 = 'l2'
+METRIC_COSINE = 'cosine'
+FAISS_METRICS = {
+    METRIC_L2: faiss.METRIC_L2,
+    METRIC_COSINE: faiss.METRIC_INNER_PRODUCT,
+}
+
+# vector storage of flat, ivf_flat and hnsw indices, faiss scalar quantizers
+# float16: half precision, 2x smaller; int8: 8 bits per dimension scaled by its trained range, 4x smaller
+STORAGE_FLOAT32 = 'float32'
+STORAGE_FLOAT16 = 'float16'
+STORAGE_INT8 = 'int8'
+STORAGE_CODES = {
+    STORAGE_FLOAT32: 'Flat',
+    STORAGE_FLOAT16: 'SQfp16',
+    STORAGE_INT8: 'SQ8',
+}
+STORAGE_BYTES = {
+    STORAGE_FLOAT32: 4,
+    STORAGE_FLOAT16: 2,
+    STORAGE_INT8: 1,
+}
+
+# pools below it are searched by numpy in auto mode, measured by benchmark.calibrate_numpy_limit.
+# 0 on the reference single core host, where the numpy matmul alone is slower than a whole faiss flat
+# search at every size, set it per host from the calibration
+NUMPY_SEARCH_LIMIT = int(os.getenv('NUMPY_SEARCH_LIMIT', 0))
+# pools below it are searched exactly in auto mode
+EXACT_SEARCH_LIMIT = 10000
+# pools above it use ivf, hnsw graphs get too slow to build and too big
+HNSW_LIMIT = 1000000
+# 8 bits product quantizer trains 256 centroids per sub vector
+PQ_MIN_TRAINING = 256
+# index types whose vectors can be removed in place, others are rebuilt on compaction
+REMOVABLE_INDEX_TYPES = [INDEX_FLAT, INDEX_IVF_FLAT, INDEX_IVF_PQ, INDEX_NUMPY]
+
+INDEX_FILE_NAME = 'index.faiss'
+INDEX_META_FILE_NAME = 'index.json'
+INDEX_LABELS_FILE_NAME = 'labels.npz'
+
 
 class SentenceFaiss:
-    def __init__(self, vector_pool: Union[List[Tensor], np.ndarray, Tensor]):
+    def __init__(self,
+                 vector_pool: Union[List[Tensor], np.ndarray, Tensor],
+                 index_type: Text = INDEX_FLAT,
+                 nlist: Optional[int] = None,
+                 nprobe: int = 8,
+                 ef_search: int = 64,
+                 hnsw_m: int = 32,
+                 pq_m: Optional[int] = None,
+                 memory_budget: Optional[int] = None,
+                 metric: Text = METRIC_L2,
+                 ids: Optional[Iterable[int]] = None,
+                 compact_ratio: float = 0.2,
+                 storage: Text = STORAGE_FLOAT32):
+        """
+        ids: stable int64 ids of the pool rows, default to the row numbers.
+        Search results, `add`, `remove` and `upsert` all speak these ids.
+        storage: float32, float16 or int8 vectors
+        The pool is copied and normalized until `train`, then the index holds the only copy.
+        """
+        if metric not in FAISS_METRICS:
+            raise ValueError(f'Unknown metric {metric}, choose from {list(FAISS_METRICS)}')
+        if storage not in STORAGE_CODES:
+            raise ValueError(f'Unknown storage {storage}, choose from {list(STORAGE_CODES)}')
+        # private normalized copy, the caller's array is never modified, released by train
+        vector_pool = self.as_unit_vectors(vector_pool)
+        size, dimension = vector_pool.shape
+        if index_type == INDEX_AUTO:
+            index_type = self.select_index_type(size, dimension, memory_budget, hnsw_m, storage)
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f'Unknown index type {index_type}, choose from {INDEX_TYPES}')
+        if index_type == INDEX_IVF_PQ and size < PQ_MIN_TRAINING:
+            logger.warning(f'{size} vectors are too few to train PQ, fall back to {INDEX_IVF_FLAT}')
+            index_type = INDEX_IVF_FLAT
+        if index_type == INDEX_NUMPY and storage != STORAGE_FLOAT32:
+            raise ValueError(f'{INDEX_NUMPY} searches float32 storage only')
+        vector_ids = np.arange(size, dtype=np.int64) if ids is None else self.as_ids(ids)
+        if len(vector_ids) != size:
+            raise ValueError(f'{len(vector_ids)} ids for {size} vectors')
+        self._setup(index_type=index_type, metric=metric, storage=storage, dimension=dimension,
+                    nlist=nlist or self.default_nlist(size), nprobe=nprobe, ef_search=ef_search, hnsw_m=hnsw_m,
+                    pq_m=pq_m or self.default_pq_m(dimension), compact_ratio=compact_ratio, vector_ids=vector_ids,
+                    vector_pool=vector_pool)
+
+    # parameters persisted by `save`, given back to `_setup` by `load`
+    index_params = ['index_type', 'metric', 'storage', 'dimension', 'nlist', 'nprobe', 'ef_search', 'hnsw_m', 'pq_m',
+                    'compact_ratio']
+
+    def _setup(self,
+               index_type: Text,
+               metric: Text,
+               storage: Text,
+               dimension: int,
+               nlist: int,
+               nprobe: int,
+               ef_search: int,
+               hnsw_m: int,
+               pq_m: int,
+               compact_ratio: float,
+               vector_ids: np.ndarray,
+               vector_pool: Optional[np.ndarray] = None,
+               faiss_index: Optional[faiss.Index] = None):
+        """Every attribute of an index, shared by `__init__` and `load`, an empty new index by default."""
+        self.index_type = index_type
+        self.metric = metric
+        self.storage = storage
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.pq_m = pq_m
+        self.compact_ratio = compact_ratio
+        self.vector_ids = vector_ids
         self.vector_pool = vector_pool
-        self.faiss_index = faiss.IndexFlatL2(vector_pool.shape[1])
+        self.faiss_index = faiss_index if faiss_index is not None else faiss.IndexIDMap2(self._new_index())
+
+        # the index stores internal labels, an upsert gets a new label and the old one is
+        # tombstoned, so removing is O(k) and a search skips tombstones by an id selector.
+        # searches share the lock and run concurrently, add / remove / compact hold it alone
+        self._lock = RWLock()
+        self._next_label = 0
+        self._label_ids = np.empty(0, dtype=np.int64)
+        self._deleted = np.empty(0, dtype=np.uint8)
+        self._n_deleted = 0
+        self._id_labels: Optional[Dict[int, int]] = None
+        self._storage_view: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.read_only = False
+
+    def _new_index(self) -> faiss.Index:
+        return faiss.index_factory(self.dimension, self.index_description, FAISS_METRICS[self.metric])
+
+    @staticmethod
+    def select_index_type(size: int,
+                          dimension: int,
+                          memory_budget: Optional[int] = None,
+                          hnsw_m: int = 32,
+                          storage: Text = STORAGE_FLOAT32) -> Text:
+        """
+        1, small pools are searched exactly, the smallest by numpy
+        2, pools over the memory budget are compressed with product quantization
+        3, up to a million vectors use hnsw, above that ivf
+        """
+        if size < NUMPY_SEARCH_LIMIT and storage == STORAGE_FLOAT32:
+            return INDEX_NUMPY
+        if size < EXACT_SEARCH_LIMIT:
+            return INDEX_FLAT
+        flat_bytes = size * dimension * STORAGE_BYTES[storage]
+        if memory_budget is not None and flat_bytes > memory_budget:
+            return INDEX_IVF_PQ
+        hnsw_bytes = flat_bytes + size * hnsw_m * 2 * 4
+        if size < HNSW_LIMIT and (memory_budget is None or hnsw_bytes <= memory_budget):
+            return INDEX_HNSW
+        return INDEX_IVF_FLAT
+
+    @staticmethod
+    def default_nlist(size: int) -> int:
+        # faiss guideline: 4 * sqrt(n) lists, at least 39 training points per list
+        return max(1, min(int(4 * math.sqrt(size)), size // 39))
+
+    @staticmethod
+    def default_pq_m(dimension: int) -> int:
+        # largest divisor of d giving sub vectors of 8 dimensions at least, 32x smaller than float32
+        for m in range(max(1, dimension // 8), 0, -1):
+            if dimension % m == 0:
+                return m
+        return 1
+
+    @property
+    def index_description(self) -> Text:
+        codes = STORAGE_CODES[self.storage]
+        if self.index_type == INDEX_IVF_FLAT:
+            return f'IVF{self.nlist},{codes}'
+        if self.index_type == INDEX_HNSW:
+            return f'HNSW{self.hnsw_m}' if self.storage == STORAGE_FLOAT32 else f'HNSW{self.hnsw_m}_{codes}'
+        if self.index_type == INDEX_IVF_PQ:
+            return f'IVF{self.nlist},PQ{self.pq_m}'
+        return codes
+
+    @staticmethod
+    def as_ids(ids: Iterable[int]) -> np.ndarray:
+        return np.array(ids, dtype=np.int64, ndmin=1).reshape(-1)
+
+    def _set_search_parameters(self):
+        params = faiss.ParameterSpace()
+        if self.index_type in (INDEX_IVF_FLAT, INDEX_IVF_PQ):
+            params.set_index_parameter(self.faiss_index, 'nprobe', self.nprobe)
+        elif self.index_type == INDEX_HNSW:
+            params.set_index_parameter(self.faiss_index, 'efSearch', self.ef_search)
+
+    @property
+    def score_key(self) -> Text:
+        return 'scores' if self.metric == METRIC_COSINE else 'distances'
+
+    @property
+    def higher_is_better(self) -> bool:
+        return self.metric == METRIC_COSINE
 
     @classmethod
     def normalize(cls, vector: Union[List[Tensor], np.ndarray, Tensor]):
         return faiss.normalize_L2(vector)
 
+    @classmethod
+    def as_unit_vectors(cls, vector: Union[List[Tensor], np.ndarray, Tensor], inplace: bool = False) -> np.ndarray:
+        """
+        Contiguous (n, d) float32 unit vectors, by default one explicit copy normalized in place.
+        inplace: `vector` belongs to the caller's scratch space, a C contiguous float32 array is normalized
+        as it is, without any allocation
+        """
+        if inplace:
+            _vector = np.require(vector, dtype=np.float32, requirements=['C', 'W'])
+            if _vector.ndim == 1:
+                _vector = _vector.reshape(1, -1)
+        else:
+            _vector = np.array(vector, dtype=np.float32, order='C', ndmin=2, copy=True)
+        cls.normalize(_vector)
+        return _vector
+
+    @staticmethod
+    def set_num_threads(num_threads: int):
+        """Process wide, every search runs on faiss' openmp pool of this size."""
+        faiss.omp_set_num_threads(num_threads)
+
+    def _search_parameters(self, selector) -> faiss.SearchParameters:
+        if self.index_type in (INDEX_IVF_FLAT, INDEX_IVF_PQ):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if self.index_type == INDEX_HNSW:
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+
+    def _label_filter(self, ids: Optional[Iterable[int]]) -> Tuple[Optional[np.ndarray], bool]:
+        """
+        Bitmap over labels and whether it holds the allowed labels (`ids` given)
+        or the tombstoned ones, None when every label may be returned.
+        """
+        if ids is not None:
+            labels = [self.id_labels[i] for i in self.as_ids(ids).tolist() if i in self.id_labels]
+            allowed = np.zeros(max(1, (self._next_label + 7) // 8), dtype=np.uint8)
+            labels = np.array(labels, dtype=np.int64)
+            np.bitwise_or.at(allowed, labels >> 3, (1 << (labels & 7)).astype(np.uint8))
+            return allowed, True
+        if self._n_deleted:
+            return self._deleted, False
+        return None, False
+
+    @property
+    def next_label(self) -> int:
+        """Label of the next added vector, it moves with every add or upsert."""
+        return self._next_label
+
+    def id_bitmap(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        Reusable filter of `search_batch`, for an id set searched many times.
+        It stays valid while `next_label` is unchanged and these ids are not removed.
+        """
+        with self._lock.read():
+            return self._label_filter(ids)[0]
+
+    def _faiss_search(self, queries: np.ndarray, top_k: int, bitmap: Optional[np.ndarray], allowed: bool):
+        params = None
+        if bitmap is not None:
+            # bitmap and selectors must stay referenced during the search
+            # sized in bytes, labels past the bitmap are not members
+            selector = bitmap_selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+            if not allowed:
+                selector = faiss.IDSelectorNot(bitmap_selector)
+            params = self._search_parameters(selector)
+        return self.faiss_index.search(queries, k=top_k, params=params)
+
+    def _numpy_search(self, queries: np.ndarray, top_k: int, bitmap: Optional[np.ndarray], allowed: bool):
+        """
+        Exact search on a zero copy view of the flat storage, one matmul and one partition for all queries.
+        Same output as faiss: padded with -1 labels and inf scores (-inf for cosine),
+        the order of tied scores is up to the backend.
+        """
+        positions, vectors = self.storage_view
+        size = len(positions)
+        scores = np.full((len(queries), top_k), -np.inf if self.higher_is_better else np.inf, dtype=np.float32)
+        labels = np.full((len(queries), top_k), -1, dtype=np.int64)
+        if not size:
+            return scores, labels
+
+        # unit vectors: the nearest rows have the largest inner product, |q - x|^2 = 2 - 2 q.x
+        ranked = queries @ vectors.T
+        np.negative(ranked, out=ranked)
+        if bitmap is not None:
+            # as in faiss, labels added after the bitmap was built are not members
+            inside = (positions >> 3) < len(bitmap)
+            member = np.zeros(size, dtype=bool)
+            member[inside] = (bitmap[positions[inside] >> 3] >> (positions[inside] & 7).astype(np.uint8)) & 1 == 1
+            ranked[:, member != allowed] = np.inf
+
+        k = min(top_k, size)
+        top = np.argpartition(ranked, k - 1, axis=1)[:, :k]
+        best = np.take_along_axis(ranked, top, axis=1)
+        order = np.argsort(best, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        found = np.isfinite(best)
+        inner = -best
+        found_scores = inner if self.higher_is_better else np.maximum(2 - 2 * inner, 0)
+        scores[:, :k] = np.where(found, found_scores, scores[:, :k])
+        labels[:, :k] = np.where(found, positions[top], -1)
+        return scores, labels
+
+    @property
+    def storage_view(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Label and zero copy vector of each position of the flat storage, cached until the index is updated."""
+        view = self._storage_view
+        if view is None:
+            flat = faiss.downcast_index(self.faiss_index.index)
+            vectors = faiss.rev_swig_ptr(flat.get_xb(), flat.ntotal * self.dimension) if flat.ntotal else \
+                np.empty(0, dtype=np.float32)
+            view = self._storage_view = (faiss.vector_to_array(self.faiss_index.id_map),
+                                         vectors.reshape(flat.ntotal, self.dimension))
+        return view
+
+    def _search(self,
+                queries: Union[List[Tensor], np.ndarray, Tensor],
+                top_k: int,
+                ids: Optional[Iterable[int]] = None,
+                inplace: bool = False,
+                id_bitmap: Optional[np.ndarray] = None):
+        _queries = self.as_unit_vectors(queries, inplace)
+        with self._lock.read():
+            bitmap, allowed = (id_bitmap, True) if id_bitmap is not None else self._label_filter(ids)
+            if self.index_type == INDEX_NUMPY:
+                scores, labels = self._numpy_search(_queries, top_k, bitmap, allowed)
+            else:
+                scores, labels = self._faiss_search(_queries, top_k, bitmap, allowed)
+            return scores, np.where(labels >= 0, self._label_ids[labels], -1)
+
     def process(self, query: Union[List[Tensor], np.ndarray, Tensor], top_k: int) -> Dict:
-        _vector = np.array([query])
-        self.normalize(_vector)
-        distances, ann = self.faiss_index.search(_vector, k=top_k)
+        # a single vector or a (n, d) matrix of queries, searched in one call
+        scores, ann = self._search(query, top_k)
         return {
-            'distances': distances,
+            self.score_key: scores,
             'ann': ann
         }
 
+    def search_batch(self,
+                     queries: Union[np.ndarray, Tensor],
+                     top_k: int,
+                     ids: Optional[Iterable[int]] = None,
+                     inplace: bool = False,
+                     id_bitmap: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        N queries in one native call, parallelized by faiss (see `set_num_threads`).
+        ids: only these ids may be returned, one index serves many filtered pools,
+             very selective filters on hnsw may need a larger ef_search
+        inplace: normalize float32 queries in place instead of copying them, see `as_unit_vectors`
+        id_bitmap: `ids` prepared once by `id_bitmap`
+        return: structured array of shape (N, top_k), fields `ann` and `distances` / `scores`
+        """
+        scores, ann = self._search(queries, top_k, ids, inplace, id_bitmap)
+        results = np.empty(ann.shape, dtype=[('ann', np.int64), (self.score_key, np.float32)])
+        results['ann'] = ann
+        results[self.score_key] = scores
+        return results
+
     def train(self):
-        self.normalize(self.vector_pool)
-        self.faiss_index.add(self.vector_pool)
+        if not self.faiss_index.is_trained:
+            logger.info(f'Training {self.index_description} on {len(self.vector_pool)} vectors')
+            self.faiss_index.train(self.vector_pool)
+        self._set_search_parameters()
+        self._add(self.vector_ids, self.vector_pool)
+        # the index holds the vectors, a second float32 copy would double the memory of every cached index
+        self.vector_pool = None
+
+    def __len__(self):
+        return self.faiss_index.ntotal - self._n_deleted
+
+    @property
+    def id_labels(self) -> Dict[int, int]:
+        """id -> label of live vectors, built on the first update only"""
+        if self._id_labels is None:
+            labels = faiss.vector_to_array(self.faiss_index.id_map)
+            if self._n_deleted:
+                labels = labels[~self._is_deleted(labels)]
+            self._id_labels = dict(zip(self._label_ids[labels].tolist(), labels.tolist()))
+        return self._id_labels
+
+    def _is_deleted(self, labels: np.ndarray) -> np.ndarray:
+        return (self._deleted[labels >> 3] >> (labels & 7).astype(np.uint8)) & 1 == 1
+
+    def _reserve(self, size: int):
+        if size <= len(self._label_ids):
+            return
+        capacity = max(size, 2 * len(self._label_ids), 64)
+        label_ids = np.full(capacity, -1, dtype=np.int64)
+        label_ids[:len(self._label_ids)] = self._label_ids
+        deleted = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        deleted[:len(self._deleted)] = self._deleted
+        self._label_ids, self._deleted = label_ids, deleted
+
+    def _add(self, ids: np.ndarray, vectors: np.ndarray):
+        labels = np.arange(self._next_label, self._next_label + len(ids), dtype=np.int64)
+        self._reserve(self._next_label + len(ids))
+        self._label_ids[labels] = ids
+        self.faiss_index.add_with_ids(vectors, labels)
+        self._storage_view = None
+        self._next_label += len(ids)
+        if self._id_labels is not None:
+            self._id_labels.update(zip(ids.tolist(), labels.tolist()))
+
+    def add(self, ids: Iterable[int], vectors: Union[np.ndarray, Tensor]):
+        """Add new vectors, ids must not be in the index yet (see `upsert`)."""
+        ids, vectors = self.as_ids(ids), self.as_unit_vectors(vectors)
+        if len(ids) != len(vectors):
+            raise ValueError(f'{len(ids)} ids for {len(vectors)} vectors')
+        if len(np.unique(ids)) != len(ids):
+            raise ValueError('Duplicated ids')
+        self._check_writable()
+        with self._lock.write():
+            existing = [i for i in ids.tolist() if i in self.id_labels]
+            if existing:
+                raise ValueError(f'Ids {existing[:10]} are already indexed, use upsert')
+            self._add(ids, vectors)
+
+    def add_missing(self, ids: Iterable[int], vectors: Union[np.ndarray, Tensor]) -> int:
+        """Add the ids not indexed yet, for content addressed ids whose vector never changes."""
+        ids = self.as_ids(ids)
+        with self._lock.write():
+            missing = np.array([i not in self.id_labels for i in ids.tolist()], dtype=bool)
+            if missing.any():
+                self.add(ids[missing], np.asarray(vectors)[missing])
+            return int(missing.sum())
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Tombstone the vectors of these ids, unknown ids are ignored. Returns the removed count."""
+        self._check_writable()
+        with self._lock.write():
+            labels = [self.id_labels.pop(i) for i in self.as_ids(ids).tolist() if i in self.id_labels]
+            if not labels:
+                return 0
+            labels = np.array(labels, dtype=np.int64)
+            np.bitwise_or.at(self._deleted, labels >> 3, (1 << (labels & 7)).astype(np.uint8))
+            self._n_deleted += len(labels)
+            if self._n_deleted > self.compact_ratio * self.faiss_index.ntotal:
+                self.compact()
+            return len(labels)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError('Index is memory mapped read only, load it with mmap=False to update it')
+
+    def upsert(self, ids: Iterable[int], vectors: Union[np.ndarray, Tensor]):
+        """Replace the vectors of known ids, add the others."""
+        ids = self.as_ids(ids)
+        with self._lock.write():
+            self.remove(ids)
+            self.add(ids, vectors)
+
+    def compact(self):
+        """Drop tombstoned vectors from the index, hnsw can not remove so it is rebuilt."""
+        with self._lock.write():
+            if not self._n_deleted:
+                return
+            labels = faiss.vector_to_array(self.faiss_index.id_map)
+            deleted = self._is_deleted(labels)
+            logger.info(f'Compacting {self.index_description}: {deleted.sum()} of {len(labels)} removed')
+            if self.index_type in REMOVABLE_INDEX_TYPES:
+                self.faiss_index.remove_ids(faiss.IDSelectorBatch(labels[deleted]))
+            else:
+                live = labels[~deleted]
+                vectors = self.faiss_index.reconstruct_batch(live) if len(live) else None
+                self.faiss_index = faiss.IndexIDMap2(self._new_index())
+                self._set_search_parameters()
+                if len(live):
+                    # quantized storage (hnsw int8) retrains its ranges on the decoded live vectors
+                    if not self.faiss_index.is_trained:
+                        self.faiss_index.train(vectors)
+                    self.faiss_index.add_with_ids(vectors, live)
+            self._storage_view = None
+            self._deleted[:] = 0
+            self._n_deleted = 0
+
+    def live_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and vectors of the live entries, decoded from the index, lossy for compressed storage."""
+        with self._lock.write():
+            labels = faiss.vector_to_array(self.faiss_index.id_map)
+            if self._n_deleted:
+                labels = labels[~self._is_deleted(labels)]
+            if not len(labels):
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dimension), dtype=np.float32)
+            if self.index_type in (INDEX_IVF_FLAT, INDEX_IVF_PQ):
+                # inverted lists reconstruct by label through a direct map
+                faiss.extract_index_ivf(self.faiss_index.index).make_direct_map()
+            return self._label_ids[labels], self.faiss_index.reconstruct_batch(labels)
+
+    def save(self, path: Text) -> Text:
+        """
+        Persist the index with faiss' native io into the directory `path`.
+        index.faiss: faiss index, index.json: parameters, labels.npz: id bookkeeping
+        """
+        create_dir(path)
+        with self._lock.read():
+            faiss.write_index(self.faiss_index, os.path.join(path, INDEX_FILE_NAME))
+            np.savez(os.path.join(path, INDEX_LABELS_FILE_NAME),
+                     label_ids=self._label_ids[:self._next_label],
+                     deleted=self._deleted[:(self._next_label + 7) // 8],
+                     vector_ids=self.vector_ids)
+            meta = {param: getattr(self, param) for param in self.index_params}
+            meta.update(next_label=self._next_label, n_deleted=self._n_deleted)
+            write_json_to_file(os.path.join(path, INDEX_META_FILE_NAME), meta)
+        return path
+
+    @classmethod
+    def load(cls, path: Text, mmap: bool = True) -> 'SentenceFaiss':
+        """
+        Load an index saved by `save`.
+        mmap: map the vectors read only instead of reading them, worker processes
+        loading the same file share its physical pages, updates are refused.
+        """
+        meta = read_json_file(os.path.join(path, INDEX_META_FILE_NAME))
+        flags = 0
+        if mmap:
+            # ivf maps its inverted lists, flat and hnsw map their flat codes
+            ivf = meta['index_type'] in (INDEX_IVF_FLAT, INDEX_IVF_PQ)
+            flags = (faiss.IO_FLAG_MMAP if ivf else faiss.IO_FLAG_MMAP_IFC) | faiss.IO_FLAG_READ_ONLY
+
+        sf = cls.__new__(cls)
+        with np.load(os.path.join(path, INDEX_LABELS_FILE_NAME)) as labels:
+            sf._setup(vector_ids=labels['vector_ids'],
+                      faiss_index=faiss.read_index(os.path.join(path, INDEX_FILE_NAME), flags),
+                      **{param: meta[param] for param in cls.index_params})
+            sf._label_ids = labels['label_ids']
+            sf._deleted = labels['deleted']
+        sf._set_search_parameters()
+        sf._next_label = meta['next_label']
+        sf._n_deleted = meta['n_deleted']
+        sf.read_only = mmap
+        return sf
+
+    def evaluate(self,
+                 queries: Union[np.ndarray, Tensor],
+                 vector_pool: Union[np.ndarray, Tensor],
+                 top_k: int = 5) -> Dict:
+        """
+        Recall and latency of this index against exact search over `vector_pool`, the pool it was built from.
+        recall: share of the exact top k found by this index
+        """
+        _queries = self.as_unit_vectors(queries)
+        exact = faiss.IndexFlat(self.faiss_index.d, FAISS_METRICS[self.metric])
+        exact.add(self.as_unit_vectors(vector_pool))
+
+        start = time.perf_counter()
+        _, truth = exact.search(_queries, k=top_k)
+        exact_latency = (time.perf_counter() - start) / len(_queries)
+        truth = self.vector_ids[truth]
+        start = time.perf_counter()
+        _, ann = self._search(_queries, top_k, inplace=True)
+        latency = (time.perf_counter() - start) / len(_queries)
+
+        hits = sum(len(set(found) & set(expected)) for found, expected in zip(ann, truth))
+        return {
+            'index_type': self.index_type,
+            'index': self.index_description,
+            'recall': hits / truth.size,
+            'latency_ms': latency * 1000,
+            'exact_latency_ms': exact_latency * 1000,
+        }
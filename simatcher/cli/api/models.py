@@ -8,11 +8,23 @@ class BKChatModel(BaseModel):
     filter: Dict = None
 
 
+class BKChatBatchModel(BaseModel):
+    texts: List[str]
+    filter: Dict = None
+
+
 class KBTrainModel(BaseModel):
     knowledge_base_id: str
     training_data: Dict
     llm_model: str = None
     is_remove_archive: bool = False
+    incremental: bool = False
+
+
+class KBDeleteModel(BaseModel):
+    knowledge_base_id: str
+    ids: List[str] = []
+    sources: List[str] = []
 
 
 class KBPredictModel(BaseModel):
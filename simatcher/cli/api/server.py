@@ -7,10 +7,12 @@ from fastapi.responses import JSONResponse
 
 from simatcher.cli.api.auth import SelfOAuth2PasswordBearer
 from simatcher.cli.api.reponse import Response
-from simatcher.engine import BKChatEngine, KnowledgeBaseEngine
+from simatcher.engine import BKChatEngine, KnowledgeBaseEngine, engine_registry
+from simatcher.engine.bk.bkchat import close_session, shutdown_executor
+from simatcher.engine.bk.bkchat.config import BKCHAT_PIPELINE_CONFIG
 from simatcher.exceptions import Error
 from .models import (
-    BKChatModel, KBTrainModel, KBPredictModel
+    BKChatModel, BKChatBatchModel, KBTrainModel, KBPredictModel, KBDeleteModel
 )
 
 
@@ -25,6 +27,18 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def load_engines():
+    # build the shared engine before the first request, model loading takes seconds
+    engine_registry.get(BKChatEngine, BKCHAT_PIPELINE_CONFIG)
+
+
+@app.on_event("shutdown")
+async def close_connections():
+    await close_session()
+    shutdown_executor(wait=False)
+
+
 @app.exception_handler(Error)
 async def unicorn_exception_handler(request: Request, exc: Error):
     return JSONResponse(
@@ -40,13 +54,27 @@ async def unicorn_exception_handler(request: Request, exc: Error):
 
 @app.post("/api/bkchat/")
 async def predict_bkchat(item: BKChatModel, bk_uid: Optional[str] = Cookie(None)):
-    engine = BKChatEngine()
-    pool = await engine.load_corpus_text(**item.filter)
-    slots = await engine.load_slots(**item.filter)
-    result = engine.classify(item.text, pool=pool, regex_features=slots)
+    engine = engine_registry.get(BKChatEngine, BKCHAT_PIPELINE_CONFIG)
+    pool, slots = await engine.load_resources(**(item.filter or {}))
+    result = await engine.classify_async(item.text, pool=pool, regex_features=slots, pool_filter=item.filter)
+    return Response(data=result)
+
+
+@app.post("/api/bkchat/batch/")
+async def predict_bkchat_batch(item: BKChatBatchModel, bk_uid: Optional[str] = Cookie(None)):
+    engine = engine_registry.get(BKChatEngine, BKCHAT_PIPELINE_CONFIG)
+    pool, slots = await engine.load_resources(**(item.filter or {}))
+    result = await engine.classify_batch_async(item.texts, pool=pool, regex_features=slots,
+                                               pool_filter=item.filter)
     return Response(data=result)
 
 
+@app.get("/api/bkchat/metrics/")
+async def bkchat_metrics(bk_uid: Optional[str] = Cookie(None)):
+    engine = engine_registry.get(BKChatEngine, BKCHAT_PIPELINE_CONFIG)
+    return Response(data=engine.metrics())
+
+
 @app.post("/api/kb/train/")
 def train_kb(item: KBTrainModel, background_tasks: BackgroundTasks, bk_uid: Optional[str] = Cookie(None)):
     kb = KnowledgeBaseEngine()
@@ -54,10 +82,18 @@ def train_kb(item: KBTrainModel, background_tasks: BackgroundTasks, bk_uid: Opti
                               item.training_data,
                               item.knowledge_base_id,
                               item.llm_model,
-                              item.is_remove_archive)
+                              item.is_remove_archive,
+                              item.incremental)
     return Response()
 
 
+@app.post("/api/kb/documents/delete/")
+def delete_kb_documents(item: KBDeleteModel, bk_uid: Optional[str] = Cookie(None)):
+    kb = KnowledgeBaseEngine()
+    removed = kb.delete_documents(item.knowledge_base_id, item.ids, item.sources)
+    return Response(data={'removed': removed})
+
+
 @app.post("/api/kb/predict/")
 def predict_kb(item: KBPredictModel, bk_uid: Optional[str] = Cookie(None)):
     kb = KnowledgeBaseEngine()
@@ -0,0 +1,125 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence
+
+from simatcher.log import logger
+
+_STOP = object()
+
+
+class MicroBatcher(object):
+    """
+    Coalesce concurrent calls of a batch function.
+    1, a caller alone runs `batch_func` in its own thread, nothing waits for company
+    2, callers arriving while others are in flight queue their item, a worker thread
+       takes every queued item up to `max_batch_size`, waiting at most `max_wait`
+       seconds for the next one once the queue is empty, 0 flushes at once
+    3, `batch_func` runs once over the batch, results go back in order
+    `batch_func` may run in several threads at once, it has to be thread safe.
+    """
+
+    def __init__(self,
+                 batch_func: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 32,
+                 max_wait: float = 0.):
+        self.batch_func = batch_func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._inflight = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        for key in ('_queue', '_thread', '_lock'):
+            d.pop(key, None)
+        d['_inflight'] = 0
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __call__(self, item: Any) -> Any:
+        with self._lock:
+            alone = not self._inflight
+            self._inflight += 1
+        try:
+            if alone:
+                return self._process([item])[0]
+            return self.submit(item).result()
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def submit(self, item: Any) -> Future:
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def _process(self, items: List[Any]) -> Sequence[Any]:
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+        results = self.batch_func(items)
+        if len(results) != len(items):
+            raise ValueError(f'{len(results)} results for a batch of {len(items)}')
+        return results
+
+    def _collect(self, first) -> List:
+        batch = [first]
+        while len(batch) < self.max_batch_size:
+            try:
+                task = self._queue.get(timeout=self.max_wait) if self.max_wait > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if task is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(task)
+        return batch
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is _STOP:
+                return
+            batch = self._collect(task)
+            try:
+                results = self._process([item for item, _ in batch])
+            except BaseException as e:
+                logger.error(f'Micro batch of {len(batch)} failed: {e!r}')
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        """Stop the worker once the queued items are processed."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': self.items / self.batches if self.batches else 0.,
+        }
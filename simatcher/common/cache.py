@@ -0,0 +1,332 @@
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Text, Tuple
+
+import numpy as np
+
+from simatcher.common.stdlib import normalize_text
+from simatcher.log import logger
+
+
+class LRUCache(object):
+    """
+    Thread safe LRU mapping, bounded by entry count and/or by size in bytes.
+    `sizeof` returns the size of a value, it is only needed when `max_bytes` is set.
+    `on_evict(key, value)` is called for entries evicted by the bounds, after the cache lock is released.
+    """
+
+    def __init__(self,
+                 max_size: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        del d['_lock']
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return key in self._data
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self.sizeof(self._data.pop(key))
+            self._data[key] = value
+            self.nbytes += self.sizeof(value)
+            evicted = self._evict()
+        if self.on_evict is not None:
+            for item in evicted:
+                self.on_evict(*item)
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self.nbytes -= self.sizeof(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _evict(self) -> List[Tuple[Hashable, Any]]:
+        evicted = []
+        while self._data and (
+                (self.max_size is not None and len(self._data) > self.max_size)
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            key, value = self._data.popitem(last=False)
+            self.nbytes -= self.sizeof(value)
+            self.evictions += 1
+            evicted.append((key, value))
+        return evicted
+
+    def stats(self) -> Dict[Text, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+        }
+
+
+def encode_vector(vector: np.ndarray, dtype: Text) -> Tuple[np.ndarray, float]:
+    """
+    Compact copy of a float vector and its scale.
+    float16: cast, int8: symmetric codes scaled by the largest magnitude of the vector
+    """
+    if dtype == 'int8':
+        # float division, then the int8 cast copies, the float32 input is never modified
+        scale = float(np.abs(vector).max()) / 127 or 1.
+        return np.round(vector / scale).astype(np.int8), scale
+    return vector.astype(dtype), 1.
+
+
+def decode_vector(codes: np.ndarray, scale: float) -> np.ndarray:
+    vector = codes.astype(np.float32, copy=False)
+    if scale != 1.:
+        vector *= scale
+    return vector
+
+
+class EmbeddingCache(object):
+    """
+    Content addressed sentence embeddings.
+    key: (encoder model, normalized text), value: 1-d vector stored as `dtype`, float32 / float16 / int8
+    Only texts never seen before reach the encoder, as written, texts equal once normalized share the vector
+    of the first one. The pool matrix is stacked from the cache in float32.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, dtype: Text = 'float32'):
+        if dtype not in ('float32', 'float16', 'int8'):
+            raise ValueError(f'Unsupported embedding dtype {dtype}')
+        self.dtype = dtype
+        self.cache = LRUCache(max_bytes=max_bytes,
+                              sizeof=lambda value: value[0].nbytes + 64)
+
+    def encode(self,
+               model_name: Text,
+               texts: Iterable[Text],
+               encoder: Callable[[List[Text]], np.ndarray]) -> np.ndarray:
+        texts = list(texts)
+        keys = [(model_name, normalize_text(text)) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        vectors = [decode_vector(*value) if value is not None else None for value in vectors]
+
+        missing: Dict[Tuple[Text, Text], List[int]] = OrderedDict()
+        for i, (key, vector) in enumerate(zip(keys, vectors)):
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+        if missing:
+            # the normalized text is only the key, the encoder sees the first text as written, like the queries
+            encoded = encoder([texts[positions[0]] for positions in missing.values()])
+            for (key, positions), vector in zip(missing.items(), encoded):
+                value = encode_vector(np.asarray(vector, dtype=np.float32), self.dtype)
+                self.cache.set(key, value)
+                # misses get the same lossy vector as later hits, rankings do not depend on the cache state
+                vector = decode_vector(*value)
+                for i in positions:
+                    vectors[i] = vector
+
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(vectors)
+
+    def stats(self) -> Dict[Text, Any]:
+        return self.cache.stats()
+
+
+class EmbeddingStore(object):
+    """
+    Persistent content addressed embeddings in SQLite, for knowledge base chunks.
+    key: (model, sha256 of the exact text), value: float32 vector bytes
+    Retraining the same documents, with another chunk size or after a crash, only encodes unseen chunks.
+    """
+
+    # bound parameters per statement, old sqlite builds allow 999
+    batch_size = 500
+
+    def __init__(self, path: Text):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                         'model TEXT NOT NULL, digest TEXT NOT NULL, vector BLOB NOT NULL, '
+                         'PRIMARY KEY (model, digest)) WITHOUT ROWID')
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        del d['_local']
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can not be shared by threads, one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def digest(text: Text) -> Text:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model_name: Text, digests: List[Text]) -> Dict[Text, np.ndarray]:
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(digests), self.batch_size):
+            batch = digests[start:start + self.batch_size]
+            rows = conn.execute(f'SELECT digest, vector FROM embeddings WHERE model = ? '
+                                f'AND digest IN ({",".join("?" * len(batch))})', [model_name] + batch)
+            for digest, vector in rows:
+                found[digest] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, model_name: Text, vectors: Dict[Text, np.ndarray]):
+        with self._connection() as conn:
+            conn.executemany('INSERT OR IGNORE INTO embeddings (model, digest, vector) VALUES (?, ?, ?)',
+                             [(model_name, digest, np.asarray(vector, dtype=np.float32).tobytes())
+                              for digest, vector in vectors.items()])
+
+    def encode(self,
+               model_name: Text,
+               texts: List[Text],
+               encoder: Callable[[List[Text]], np.ndarray]) -> np.ndarray:
+        digests = [self.digest(text) for text in texts]
+        vectors = self.get_many(model_name, list(set(digests)))
+
+        missing: Dict[Text, Text] = OrderedDict()
+        for digest, text in zip(digests, texts):
+            if digest not in vectors:
+                missing.setdefault(digest, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            encoded = {digest: np.asarray(vector, dtype=np.float32)
+                       for digest, vector in zip(missing, encoder(list(missing.values())))}
+            # stored as soon as encoded, a crashed training resumes from here
+            self.put_many(model_name, encoded)
+            vectors.update(encoded)
+        logger.info(f'Embedding store: {len(texts) - len(missing)} of {len(texts)} texts found')
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([vectors[digest] for digest in digests])
+
+    def stats(self) -> Dict[Text, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+        }
+
+
+class AsyncTTLCache(object):
+    """
+    Per key cache of coroutine results.
+    1, fresh (age < ttl): return the cached value
+    2, stale (age < ttl + stale_ttl): return the cached value, refresh it in background
+    3, missing or expired: load it, concurrent callers of the same key share one load
+    """
+
+    def __init__(self, ttl: float = 60, stale_ttl: float = 300, max_size: Optional[int] = 1024):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stale_hits = 0
+        self.refresh_failures = 0
+        self._entries = LRUCache(max_size=max_size)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl:
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self._start(key, loader).add_done_callback(self._on_refreshed)
+                return value
+
+        task = self._inflight.get(key) or self._start(key, loader)
+        # a cancelled caller must not cancel the load shared with others
+        return await asyncio.shield(task)
+
+    def _start(self, key: Hashable, loader: Callable[[], Awaitable]) -> asyncio.Future:
+        async def _load():
+            try:
+                value = await loader()
+                self._entries.set(key, (value, time.monotonic()))
+                return value
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.ensure_future(_load())
+        self._inflight[key] = task
+        return task
+
+    def _on_refreshed(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_failures += 1
+            logger.warning(f'Background refresh failed, keep serving stale value: {task.exception()!r}')
+
+    def invalidate(self, key: Hashable = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key)
+
+    def stats(self) -> Dict[Text, Any]:
+        return dict(self._entries.stats(),
+                    stale_hits=self.stale_hits,
+                    refresh_failures=self.refresh_failures,
+                    inflight=len(self._inflight))
@@ -0,0 +1,123 @@
+import os
+import hashlib
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from simatcher.log import logger
+from simatcher.common.stdlib import fingerprint
+
+# sentences encoded per hold of a model lock, queries get the model between the chunks of a long encode
+ENCODE_CHUNK_SIZE = 256
+
+
+def model_revision(path: Text) -> Text:
+    """
+    Revision of the model files under `path`: content hash of the json configs, size and mtime of the others.
+    Weights replaced in place give another revision, without hashing gigabytes.
+    """
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file = os.path.join(root, name)
+            relpath = os.path.relpath(file, path)
+            if name.endswith('.json'):
+                with open(file, 'rb') as f:
+                    entries.append((relpath, hashlib.sha1(f.read()).hexdigest()))
+            else:
+                stat = os.stat(file)
+                entries.append((relpath, stat.st_size, stat.st_mtime_ns))
+    return fingerprint(entries)
+
+
+class SharedModel(object):
+    """
+    A sentence transformer shared by components.
+    Encodes are serialized by its lock, fast tokenizers are not safe to call from several threads.
+    Long inputs take the lock per chunk of `ENCODE_CHUNK_SIZE`, a knowledge base training does not hold off queries.
+    """
+
+    def __init__(self, path: Text, device: Optional[Text] = None):
+        self.path = path
+        self.device = device
+        # files read before the weights, a model replaced while loading is seen as changed next time
+        self.revision = model_revision(path)
+        self.model = SentenceTransformer(path, device=device)
+        self.lock = threading.Lock()
+        self.refs = 0
+        self.nbytes = sum(tensor.numel() * tensor.element_size()
+                          for tensor in list(self.model.parameters()) + list(self.model.buffers()))
+
+    def encode(self, sentences, **kwargs):
+        if isinstance(sentences, str) or len(sentences) <= ENCODE_CHUNK_SIZE:
+            with self.lock:
+                return self.model.encode(sentences, **kwargs)
+        chunks = []
+        for start in range(0, len(sentences), ENCODE_CHUNK_SIZE):
+            with self.lock:
+                chunks.append(self.model.encode(sentences[start:start + ENCODE_CHUNK_SIZE], **kwargs))
+        if isinstance(chunks[0], np.ndarray):
+            return np.concatenate(chunks)
+        if isinstance(chunks[0], torch.Tensor):
+            return torch.cat(chunks)
+        return [embedding for chunk in chunks for embedding in chunk]
+
+
+class ModelRegistry(object):
+    """
+    Process-wide encoder models, keyed by model path and device.
+    1, the first borrower loads the model, the others share the same weights
+    2, borrowers are counted, a model is dropped with its last borrower
+    3, `borrow` ties the reference to the lifetime of its owner
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[Text, Optional[Text]], SharedModel] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: Text, device: Optional[Text]) -> Tuple[Text, Optional[Text]]:
+        return os.path.abspath(path), device
+
+    def acquire(self, path: Text, device: Optional[Text] = None) -> SharedModel:
+        key = self._key(path, device)
+        with self._lock:
+            shared = self._models.get(key)
+            if shared is None:
+                logger.info(f'Loading encoder model {path} on {device or "default device"}')
+                shared = self._models[key] = SharedModel(path, device)
+            shared.refs += 1
+            return shared
+
+    def release(self, path: Text, device: Optional[Text] = None):
+        key = self._key(path, device)
+        with self._lock:
+            shared = self._models.get(key)
+            if shared is None:
+                return
+            shared.refs -= 1
+            if shared.refs <= 0:
+                logger.info(f'Releasing encoder model {path}')
+                del self._models[key]
+
+    def borrow(self, owner: Any, path: Text, device: Optional[Text] = None) -> SharedModel:
+        """Acquire a model, released when `owner` is garbage collected."""
+        shared = self.acquire(path, device)
+        weakref.finalize(owner, self.release, path, device)
+        return shared
+
+    def stats(self) -> List[Dict[Text, Any]]:
+        with self._lock:
+            return [{'path': shared.path, 'device': shared.device, 'refs': shared.refs, 'bytes': shared.nbytes}
+                    for shared in self._models.values()]
+
+    def __len__(self):
+        return len(self._models)
+
+
+model_registry = ModelRegistry()
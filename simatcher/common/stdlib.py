@@ -1,12 +1,15 @@
 import os
+import json
+import hashlib
 import string
 import random
-from typing import Dict, Generator, List, Callable, Text
+import unicodedata
+from typing import Any, Dict, Generator, List, Callable, Text
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 def override_defaults(defaults: Dict, custom: Dict) -> Dict:
-    cfg = defaults or {}
+    cfg = dict(defaults) if defaults else {}
     if custom:
         cfg.update(custom)
     return cfg
@@ -44,3 +47,22 @@ def get_random_str(count: int = 8) -> Text:
 def module_path_from_object(o):
     """Returns the fully qualified class path of the instantiated object."""
     return o.__class__.__module__ + "." + o.__class__.__name__
+
+
+def normalize_text(text: Text) -> Text:
+    """NFKC, lower case and single spaces, used as the key of text based caches."""
+    return ' '.join(unicodedata.normalize('NFKC', str(text)).lower().split())
+
+
+def fingerprint(*objs: Any) -> Text:
+    """Stable content hash of json serializable objects."""
+    content = json.dumps(objs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def document_id(document: Dict) -> Text:
+    """Id of a knowledge base document: its `id`, its `doc_url`, or the hash of its text."""
+    for key in ('id', 'doc_url'):
+        if document.get(key) not in (None, ''):
+            return str(document[key])
+    return fingerprint(document.get('text'))
@@ -7,12 +7,16 @@ TOKENS = 'tokens'
 INTENT = 'intent'
 ENTITIES = 'entities'
 RANKING = 'intent_ranking'
+EXACT_MATCH = 'exact_match'
+# pipeline context: metric of the ranking scores, provided by the vector classifier
+SCORE_METRIC = 'score_metric'
 
 VECTOR_STORE = 'vectorstore'
 
 POOL = 'pool'
 POOL_FEATURES = 'pool_features'
-POOL_DATA_FRAME = 'pool_data_frame'
+POOL_COLUMNS = 'pool_columns'
+POOL_FILTER = 'pool_filter'
 
 REGEX_FEATURES = 'regex_features'
 
@@ -29,6 +33,7 @@ FEATURIZER_BERT = 'BertFeaturizer'
 FEATURIZER_LANGCHAIN = 'LangchainFeaturizer'
 
 CLASSIFIER_L2 = 'L2Classifier'
+CLASSIFIER_EXACT_MATCH = 'ExactMatchClassifier'
 CLASSIFIER_LANGCHAIN = 'LangchainClassifier'
 
 EXTRACTOR_REGEX_RULE = 'RegexRuleEntityExtractor'
@@ -1,3 +1,4 @@
 from .bk.bkchat import BKChatEngine
 from .bk.kb import KnowledgeBaseEngine
 from .base import Runner
+from .registry import EngineRegistry, engine_registry
@@ -98,6 +98,38 @@ class Runner(object):
             component.process(message, **self.context)
         return message
 
+    def parse_batch(self,
+                    texts: List[Text],
+                    output_properties: Dict = None,
+                    time=None,
+                    batch_size: Optional[int] = None,
+                    **kwargs) -> List[Message]:
+        """
+        Parse many texts sharing the same kwargs (pool, regex_features...),
+        every component handles a whole batch in one `process_batch` call.
+        `batch_size` bounds the texts handled together, None means all of them.
+        """
+        if batch_size is not None and batch_size < 1:
+            raise ValueError(f'batch_size must be positive, got {batch_size}')
+        messages = [
+            Message(text, dict(kwargs),
+                    output_properties=set(output_properties) if output_properties else None,
+                    time=time)
+            for text in texts
+        ]
+        if not messages:
+            return messages
+        batch_size = batch_size or len(messages)
+        for start in range(0, len(messages), batch_size):
+            batch = messages[start:start + batch_size]
+            for component in self.pipeline:
+                component.process_batch(batch, **self.context)
+        return messages
+
+    def metrics(self) -> Dict[Text, Dict]:
+        """Counters of the components reporting any, keyed by component name."""
+        return {component.name: component.metrics() for component in self.pipeline if component.metrics()}
+
 
 class Trainer(object):
     """
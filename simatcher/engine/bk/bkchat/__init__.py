@@ -1,15 +1,64 @@
 import json
 import copy
-from typing import Dict, List, Text, Generator, Union
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Text, Generator, Union, Tuple, Optional
 import urllib
 
 import aiohttp
 
 from simatcher.exceptions import ActionFailed
 from simatcher.engine.base import Runner
+from simatcher.common.cache import AsyncTTLCache
+from simatcher.common.models import model_registry
+from simatcher.common.stdlib import fingerprint
 from simatcher.constants import RANKING, INTENT
 from .config import *
 
+_session: Optional[aiohttp.ClientSession] = None
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """App lifetime session, connections to the api gateway are pooled and kept alive."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=BKCHAT_HTTP_POOL_SIZE,
+                                         limit_per_host=BKCHAT_HTTP_POOL_SIZE_PER_HOST,
+                                         keepalive_timeout=BKCHAT_HTTP_KEEPALIVE,
+                                         ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=BKCHAT_HTTP_TIMEOUT,
+                                        connect=BKCHAT_HTTP_CONNECT_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Bounded executor running the cpu bound pipeline, the event loop stays free for io.
+    Threads share the engine, its caches and indices, torch and faiss release the gil.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BKCHAT_EXECUTOR_WORKERS,
+                                       thread_name_prefix='bkchat')
+    return _executor
+
+
+def shutdown_executor(wait: bool = True):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+    _executor = None
+
 
 async def _load_data_from_remote(path: str,
                                  host: str = BKCHAT_APIGW_ROOT,
@@ -18,10 +67,13 @@ async def _load_data_from_remote(path: str,
                                            'bk_app_secret': BKCHAT_APP_SECRET})
     url = f"{host}/{path}?{access_token}"
     try:
-        async with aiohttp.request(method, url, **kwargs) as resp:
+        async with get_session().request(method, url, **kwargs) as resp:
             if 200 <= resp.status < 300:
                 return json.loads(await resp.text())
             raise ActionFailed(502)
+    except asyncio.TimeoutError:
+        # before ClientError: aiohttp timeouts subclass both
+        raise ActionFailed(504, 'HTTP request timeout')
     except aiohttp.InvalidURL:
         raise ActionFailed(401, 'API root url invalid')
     except aiohttp.ClientError:
@@ -32,6 +84,9 @@ class BKChatEngine:
     def __init__(self, pipeline_config: Dict = BKCHAT_PIPELINE_CONFIG, *args, **kwargs):
         self.pipeline_config = pipeline_config.copy()
         self.runner = Runner.load(self.pipeline_config)
+        self.resource_cache = AsyncTTLCache(ttl=BKCHAT_CACHE_TTL,
+                                            stale_ttl=BKCHAT_CACHE_STALE_TTL,
+                                            max_size=BKCHAT_CACHE_SIZE)
 
     @classmethod
     async def load_slots(cls, **kwargs) -> Generator:
@@ -67,25 +122,79 @@ class BKChatEngine:
                 utterance_intents.append(intent)
         return utterance_intents
 
+    async def load_resources(self, **kwargs) -> Tuple[Optional[List], List]:
+        """
+        Corpus and slots of a filter, fetched concurrently.
+        Cached per filter with ttl, stale values are refreshed in background.
+        The result is shared by requests, do not modify it.
+        """
+        async def _fetch():
+            return tuple(await asyncio.gather(self.load_corpus_text(**kwargs),
+                                              self.load_slots(**kwargs)))
+
+        return await self.resource_cache.get(fingerprint(kwargs), _fetch)
+
+    @staticmethod
+    def _prune(text: Text) -> Text:
+        prune = text.split(' ', maxsplit=1)
+        prune[0] = prune[0].lower()
+        return ' '.join(prune)
+
     def classify(self,
                  text: Text,
                  pool: List,
                  output_properties: Dict = None,
                  only_output_properties=True,
-                 regex_features: List = None):
+                 regex_features: List = None,
+                 pool_filter: Dict = None):
         if not pool:
             return {}
         output_properties = output_properties or {RANKING, INTENT}
-        prune = text.split(' ', maxsplit=1)
-        prune[0] = prune[0].lower()
-        prune = ' '.join(prune)
-        message = self.runner.parse(prune,
+        message = self.runner.parse(self._prune(text),
                                     output_properties=output_properties,
                                     pool=pool,
                                     text_col='utterance',
-                                    regex_features=regex_features)
+                                    regex_features=regex_features,
+                                    pool_filter=pool_filter)
         return message.as_dict(only_output_properties=only_output_properties)
 
+    def classify_batch(self,
+                       texts: List[Text],
+                       pool: List,
+                       output_properties: Dict = None,
+                       only_output_properties=True,
+                       regex_features: List = None,
+                       pool_filter: Dict = None) -> List[Dict]:
+        """Classify many texts against one pool, encoded and searched in one pass."""
+        if not pool:
+            return [{} for _ in texts]
+        output_properties = output_properties or {RANKING, INTENT}
+        messages = self.runner.parse_batch([self._prune(text) for text in texts],
+                                           output_properties=output_properties,
+                                           pool=pool,
+                                           text_col='utterance',
+                                           regex_features=regex_features,
+                                           pool_filter=pool_filter)
+        return [message.as_dict(only_output_properties=only_output_properties) for message in messages]
+
+    def _dispatch(self, method: Text, *args, **kwargs) -> asyncio.Future:
+        func = functools.partial(getattr(self, method), *args, **kwargs)
+        return asyncio.get_running_loop().run_in_executor(get_executor(), func)
+
+    async def classify_async(self, *args, **kwargs) -> Dict:
+        return await self._dispatch('classify', *args, **kwargs)
+
+    async def classify_batch_async(self, *args, **kwargs) -> List[Dict]:
+        return await self._dispatch('classify_batch', *args, **kwargs)
+
+    def metrics(self) -> Dict:
+        """Counters of this process."""
+        return {
+            'pipeline': self.runner.metrics(),
+            'resource_cache': self.resource_cache.stats(),
+            'models': model_registry.stats(),
+        }
+
     def extractor(self):
         pass
 
@@ -4,10 +4,27 @@ import os
 BKCHAT_APP_ID = os.getenv('BKCHAT_APP_ID')
 BKCHAT_APP_SECRET = os.getenv('BKCHAT_APP_SECRET')
 BKCHAT_APIGW_ROOT = os.getenv('BKCHAT_APIGW_ROOT')
+# shared http connection pool to the api gateway
+BKCHAT_HTTP_POOL_SIZE = int(os.getenv('BKCHAT_HTTP_POOL_SIZE', 100))
+BKCHAT_HTTP_POOL_SIZE_PER_HOST = int(os.getenv('BKCHAT_HTTP_POOL_SIZE_PER_HOST', 20))
+BKCHAT_HTTP_KEEPALIVE = float(os.getenv('BKCHAT_HTTP_KEEPALIVE', 30))
+BKCHAT_HTTP_TIMEOUT = float(os.getenv('BKCHAT_HTTP_TIMEOUT', 10))
+BKCHAT_HTTP_CONNECT_TIMEOUT = float(os.getenv('BKCHAT_HTTP_CONNECT_TIMEOUT', 3))
+# classification runs off the event loop in a thread pool
+BKCHAT_EXECUTOR_WORKERS = int(os.getenv('BKCHAT_EXECUTOR_WORKERS', min(4, os.cpu_count() or 1)))
+# corpus and slots cache per filter, seconds
+BKCHAT_CACHE_TTL = float(os.getenv('BKCHAT_CACHE_TTL', 60))
+BKCHAT_CACHE_STALE_TTL = float(os.getenv('BKCHAT_CACHE_STALE_TTL', 300))
+BKCHAT_CACHE_SIZE = int(os.getenv('BKCHAT_CACHE_SIZE', 1024))
 BKCHAT_PIPELINE_CONFIG = {
     "language": "zh",
     "training_data": "",
     "pipeline": [
+        {
+            "name": "ExactMatchClassifier",
+            "classifier_file": "ExactMatchClassifier.pkl",
+            "class": "simatcher.nlp.classifiers.ExactMatchClassifier"
+        },
         {
             "name": "BertFeaturizer",
             "featurizer_file": "BertFeaturizer.pkl",
@@ -1,19 +1,37 @@
 import os
 import copy
-from typing import Dict
+import json
+import threading
+import weakref
+from typing import Dict, Tuple, Optional, List
 
 from jsonschema import validate as json_validate
 
 from simatcher.engine.base import Trainer, Runner
-from simatcher.common.io import read_json_file
+from simatcher.common.io import read_json_file, write_to_file
+from simatcher.common.stdlib import document_id
+from simatcher.common.cache import LRUCache
+from simatcher.common.models import model_registry
 from simatcher.exceptions import MissingArgumentError
 from simatcher.nlp.persistor import BKRepoPersistor
+from simatcher.nlp.classifiers import LangchainClassifier
 from simatcher.constants import KNOWLEDGE_BASE_DIR
 from simatcher.log import logger
 from .config import (
-    KB_PIPELINE_CONFIG, KB_ARCHIVE_PATH, KB_TRAIN_DATA_SCHEMA, KB_REFINE_NODE
+    KB_PIPELINE_CONFIG, KB_ARCHIVE_PATH, KB_TRAIN_DATA_SCHEMA, KB_REFINE_NODE,
+    KB_RUNNER_CACHE_SIZE, KB_RUNNER_CACHE_BYTES
 )
 
+# knowledge_base_id -> (runner, model signature, bytes)
+_runners = LRUCache(max_size=KB_RUNNER_CACHE_SIZE,
+                    max_bytes=KB_RUNNER_CACHE_BYTES,
+                    sizeof=lambda entry: entry[2])
+# load locks live while a load holds or waits for them, no entry outlives its loads
+_runner_locks = weakref.WeakValueDictionary()
+# trainings and deletions read, change and save the index of a kb, one writer per kb at a time
+_writer_locks = weakref.WeakValueDictionary()
+_locks_guard = threading.Lock()
+
 
 def validate_kb_name(knowledge_base_id: str) -> bool:
     # 检查是否包含预期外的字符或路径攻击关键字
@@ -22,6 +40,61 @@ def validate_kb_name(knowledge_base_id: str) -> bool:
     return True
 
 
+def _model_signature(model_dir: str) -> Tuple:
+    """Name, mtime and size of the files of a persisted model, every persist changes it."""
+    signature = []
+    for entry in os.scandir(model_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(signature))
+
+
+def _runner_bytes(runner: Runner, signature: Tuple) -> int:
+    """Pickled components plus the saved index, loaded lazily by the classifier but most of a runner's memory."""
+    return sum(size for _, _, size in signature) + sum(
+        component.index_nbytes() for component in runner.pipeline if isinstance(component, LangchainClassifier))
+
+
+def _runner_lock(knowledge_base_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _runner_locks.setdefault(knowledge_base_id, threading.Lock())
+
+
+def _writer_lock(knowledge_base_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _writer_locks.setdefault(knowledge_base_id, threading.Lock())
+
+
+def load_runner(knowledge_base_id: str, model_dir: str) -> Runner:
+    """
+    Loaded runner of a knowledge base, shared by questions.
+    1, reused while the files of the model directory are unchanged
+    2, a retrained model is loaded again, concurrent questions of a kb load it once
+    3, least recently used runners are evicted past the count / bytes bounds
+    """
+    signature = _model_signature(model_dir)
+    entry = _runners.get(knowledge_base_id)
+    if entry is not None and entry[1] == signature:
+        return entry[0]
+
+    with _runner_lock(knowledge_base_id):
+        entry = _runners.get(knowledge_base_id)
+        if entry is not None and entry[1] == signature:
+            return entry[0]
+        logger.info(f'Loading runner of knowledge base {knowledge_base_id}')
+        runner = Runner.load(model_dir)
+        _runners.set(knowledge_base_id, (runner, signature, _runner_bytes(runner, signature)))
+        return runner
+
+
+def evict_runner(knowledge_base_id: Optional[str] = None):
+    if knowledge_base_id is None:
+        _runners.clear()
+    else:
+        _runners.pop(knowledge_base_id)
+
+
 class KnowledgeBaseEngine:
     def __init__(self, pipeline_config: Dict = KB_PIPELINE_CONFIG, *args, **kwargs):
         self.pipeline_config = copy.deepcopy(pipeline_config)
@@ -32,6 +105,23 @@ class KnowledgeBaseEngine:
                 val.extend(old[key])
         return new
 
+    def _replace_documents(self, old: Dict, new: Dict) -> Dict:
+        """Archive updated by new documents, a re-sent document (same id) replaces the archived one."""
+        new_ids = {document_id(example) for example in new.get('training_examples', [])}
+        merged = copy.deepcopy(new)
+        merged['training_examples'] = [
+            example for example in old.get('training_examples', [])
+            if document_id(example) not in new_ids
+        ] + merged.get('training_examples', [])
+        for key, val in old.items():
+            if key == 'training_examples':
+                continue
+            if key in merged:
+                merged[key].extend(val)
+            else:
+                merged[key] = val
+        return merged
+
     def _insert_url(self):
         pass
 
@@ -40,40 +130,55 @@ class KnowledgeBaseEngine:
               knowledge_base_id: str,
               llm_model: str = None,
               is_remove_archive: bool = False,
+              incremental: bool = False,
               **kwargs):
         """
         1, validate input name
         2, check whether kb is existed or create one
         3, save raw files
         4, save vector store
+        incremental: only the given documents are split and embedded, then merged into the saved index
         """
         # do validate
         json_validate(training_data, KB_TRAIN_DATA_SCHEMA)
         if not validate_kb_name(knowledge_base_id):
             raise MissingArgumentError
-        # merge data
-        if os.path.isdir(os.path.join(KB_ARCHIVE_PATH, knowledge_base_id)):
-            archive_train_data = read_json_file(os.path.join(KB_ARCHIVE_PATH, knowledge_base_id,
-                                                             'model', 'training_data.json'))
-            training_data = self._merge(archive_train_data, archive_train_data)
-        # set config & train data
-        self.pipeline_config['pipeline'][2]['knowledge_base_id'] = knowledge_base_id
-        if llm_model is not None:
-            node_config = copy.deepcopy(KB_REFINE_NODE)
-            node_config['llm_model'] = llm_model
-            self.pipeline_config['pipeline'].append(node_config)
-        logger.info(f'Begin train model...\n{self.pipeline_config}')
-        trainer = Trainer(self.pipeline_config)
-        trainer.train(training_data)
-        # persist
-        logger.info(f'Begin persist model...')
-        persistor = BKRepoPersistor() if is_remove_archive else None
-        dir_name = trainer.persist(KB_ARCHIVE_PATH,
-                                   persistor=persistor,
-                                   project_name=knowledge_base_id,
-                                   fixed_model_name='model')
-        logger.info(f'Train successfully...Archive at: {dir_name}')
-        return dir_name
+        with _writer_lock(knowledge_base_id):
+            # merge data
+            archive_data_file = os.path.join(KB_ARCHIVE_PATH, knowledge_base_id, 'model', 'training_data.json')
+            archive_train_data = read_json_file(archive_data_file) if os.path.isfile(archive_data_file) else None
+            incremental = incremental and archive_train_data is not None
+            archive_data = None
+            if incremental:
+                archive_data = self._replace_documents(archive_train_data, training_data)
+                if not LangchainClassifier({'knowledge_base_id': knowledge_base_id}).has_saved_index():
+                    logger.warning(f'No saved index of {knowledge_base_id}, training the whole archive')
+                    training_data, archive_data, incremental = archive_data, None, False
+            elif archive_train_data is not None:
+                training_data = self._merge(archive_train_data, training_data)
+            # set config & train data
+            self.pipeline_config['pipeline'][2]['knowledge_base_id'] = knowledge_base_id
+            self.pipeline_config['pipeline'][2]['incremental'] = incremental
+            if llm_model is not None:
+                node_config = copy.deepcopy(KB_REFINE_NODE)
+                node_config['llm_model'] = llm_model
+                self.pipeline_config['pipeline'].append(node_config)
+            logger.info(f'Begin train model...\n{self.pipeline_config}')
+            trainer = Trainer(self.pipeline_config)
+            trainer.train(training_data)
+            if archive_data is not None:
+                # the archive keeps every document, the next full training starts from it
+                trainer.training_data = archive_data
+            # persist
+            logger.info(f'Begin persist model...')
+            persistor = BKRepoPersistor() if is_remove_archive else None
+            dir_name = trainer.persist(KB_ARCHIVE_PATH,
+                                       persistor=persistor,
+                                       project_name=knowledge_base_id,
+                                       fixed_model_name='model')
+            evict_runner(knowledge_base_id)
+            logger.info(f'Train successfully...Archive at: {dir_name}')
+            return dir_name
 
     def predict(self,
                 question: str,
@@ -90,13 +195,46 @@ class KnowledgeBaseEngine:
         model_dir = os.path.join(KB_ARCHIVE_PATH, knowledge_base_id, 'model')
         if not os.path.isdir(model_dir):
             return None
-        runner = Runner.load(model_dir)
+        runner = load_runner(knowledge_base_id, model_dir)
         message = runner.parse(question)
         return message.as_dict()
 
+    def delete_documents(self,
+                         knowledge_base_id: str,
+                         ids: List[str] = None,
+                         sources: List[str] = None) -> int:
+        """
+        1, remove the chunks of the documents from the saved index
+        2, remove the documents from the archived training data
+        documents are matched by id (see `document_id`) or by source, a doc_url or an intent
+        """
+        if not validate_kb_name(knowledge_base_id):
+            raise MissingArgumentError
+        model_dir = os.path.join(KB_ARCHIVE_PATH, knowledge_base_id, 'model')
+        if not os.path.isdir(model_dir):
+            return 0
+        with _writer_lock(knowledge_base_id):
+            ids, sources = set(ids or []), set(sources or [])
+            runner = load_runner(knowledge_base_id, model_dir)
+            removed = sum(component.delete_documents(ids, sources)
+                          for component in runner.pipeline if hasattr(component, 'delete_documents'))
+
+            data_file = os.path.join(model_dir, 'training_data.json')
+            if os.path.isfile(data_file):
+                training_data = read_json_file(data_file)
+                training_data['training_examples'] = [
+                    example for example in training_data.get('training_examples', [])
+                    if document_id(example) not in ids
+                    and example.get('doc_url') not in sources and example.get('intent') not in sources
+                ]
+                write_to_file(data_file, json.dumps(training_data, indent=2))
+            logger.info(f'{removed} chunks deleted from {knowledge_base_id}')
+            return removed
+
     @staticmethod
     def clear(knowledge_base_id: str):
         """need to set a superuser"""
+        evict_runner(knowledge_base_id)
         try:
             if os.path.isdir(os.path.join(KB_ARCHIVE_PATH, knowledge_base_id)):
                 os.chdir(KB_ARCHIVE_PATH)
@@ -107,6 +245,10 @@ class KnowledgeBaseEngine:
         except FileNotFoundError:
             logger.info(f'{knowledge_base_id} not exist')
 
+    @staticmethod
+    def metrics() -> Dict:
+        return {'runner_cache': _runners.stats(), 'models': model_registry.stats()}
+
     @staticmethod
     def check(knowledge_base_id: str):
         return os.path.isdir(os.path.join(KB_ARCHIVE_PATH, knowledge_base_id))
@@ -2,6 +2,12 @@ import os
 
 
 KB_ARCHIVE_PATH = '/app/archive'
+# loaded runners kept per knowledge base, bounded by count and by the size of their pickled components
+KB_RUNNER_CACHE_SIZE = int(os.getenv('KB_RUNNER_CACHE_SIZE', 64))
+KB_RUNNER_CACHE_BYTES = int(os.getenv('KB_RUNNER_CACHE_BYTES', 4 * 1024 * 1024 * 1024))
+# sqlite file of chunk embeddings kept across trainings, keyed by model revision and chunk text,
+# e.g. /app/archive/embeddings.sqlite3, unset to disable
+KB_EMBEDDING_STORE = os.getenv('KB_EMBEDDING_STORE') or None
 KB_PIPELINE_CONFIG = {
     "language": "zh",
     "training_data": "",
@@ -18,7 +24,8 @@ KB_PIPELINE_CONFIG = {
             "name": "LangchainFeaturizer",
             "classifier_file": "LangchainFeaturizer.pkl",
             "class": "simatcher.nlp.featurizers.LangchainFeaturizer",
-            "pre_model": "text2vec-base-chinese"
+            "pre_model": "text2vec-base-chinese",
+            "embedding_store": KB_EMBEDDING_STORE
         },
         {
             "name": "LangchainClassifier",
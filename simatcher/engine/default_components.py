@@ -2,7 +2,7 @@ from simatcher.nlp.featurizers import (
     BertFeaturizer, LangchainFeaturizer,
 )
 from simatcher.nlp.classifiers import (
-    L2Classifier, LangchainClassifier,
+    L2Classifier, LangchainClassifier, ExactMatchClassifier,
 )
 from simatcher.nlp.extractors import (
     RegexRuleEntityExtractor,
@@ -17,6 +17,7 @@ from simatcher.nlp.refiners import (
 
 COMPONENT_CLASSES = [
     LangchainSplitter,
+    ExactMatchClassifier,
     BertFeaturizer,
     LangchainFeaturizer,
     L2Classifier,
@@ -0,0 +1,61 @@
+import json
+import threading
+from typing import Dict, Text, Any, Optional, Type, Tuple
+
+from simatcher.common.stdlib import module_path_from_object
+from simatcher.log import logger
+
+
+class EngineRegistry(object):
+    """
+    Process-wide holder of long-lived engines.
+    1, engines are keyed by engine class and pipeline config
+    2, the first caller builds the engine (runner, encoder models...), others reuse it
+    3, creation is guarded by a lock, so concurrent first requests build only once
+    """
+
+    def __init__(self):
+        self._engines: Dict[Tuple[Text, Text], Any] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(engine_class: Type, pipeline_config: Optional[Dict]) -> Tuple[Text, Text]:
+        engine_path = f'{engine_class.__module__}.{engine_class.__name__}'
+        return engine_path, json.dumps(pipeline_config, sort_keys=True, default=str)
+
+    def get(self, engine_class: Type, pipeline_config: Optional[Dict] = None, **kwargs) -> Any:
+        """Return the shared engine for this config, build it on first use."""
+        key = self._key(engine_class, pipeline_config)
+        engine = self._engines.get(key)
+        if engine is not None:
+            return engine
+
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                logger.info(f'Building engine {key[0]}')
+                if pipeline_config is None:
+                    engine = engine_class(**kwargs)
+                else:
+                    engine = engine_class(pipeline_config, **kwargs)
+                self._engines[key] = engine
+        return engine
+
+    def remove(self, engine: Any):
+        with self._lock:
+            for key, value in list(self._engines.items()):
+                if value is engine:
+                    del self._engines[key]
+
+    def clear(self):
+        with self._lock:
+            self._engines.clear()
+
+    def __len__(self):
+        return len(self._engines)
+
+    def __repr__(self):
+        return f'<EngineRegistry {[module_path_from_object(e) for e in self._engines.values()]}>'
+
+
+engine_registry = EngineRegistry()
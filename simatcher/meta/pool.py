@@ -0,0 +1,46 @@
+import hashlib
+from typing import Text, Dict, List, Any, Iterable
+
+import numpy as np
+
+from simatcher.common.stdlib import normalize_text
+
+
+class Pool(object):
+    """
+    Columnar view of the utterance pool.
+    texts / ids are numpy columns, records keeps references to the intent records,
+    they are never copied, a ranking is a direct gather on the top k rows.
+    """
+    def __init__(self, records: List[Dict[Text, Any]], text_col: Text, id_col: Text = 'id'):
+        self.records = records
+        self.text_col = text_col
+        self.texts = np.array([record.get(text_col) for record in records], dtype=object)
+        self.ids = np.array([record.get(id_col) for record in records], dtype=object)
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def content_id(text: Text) -> int:
+        """Positive int64 id of a text, texts equal after `normalize_text` share one id."""
+        digest = hashlib.sha1(normalize_text(text).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') >> 1
+
+    def content_ids(self) -> np.ndarray:
+        return np.array([self.content_id(text) for text in self.texts], dtype=np.int64)
+
+    def gather(self,
+               ann: Iterable[int],
+               scores: Iterable[float],
+               score_key: Text = 'distances') -> List[Dict[Text, Any]]:
+        """Ranking records of the hit rows, faiss pads missing hits with -1."""
+        results = []
+        for row, score in zip(ann, scores):
+            row = int(row)
+            if row < 0:
+                continue
+            result = {score_key: float(score), 'ann': row}
+            result.update(self.records[row])
+            results.append(result)
+        return results
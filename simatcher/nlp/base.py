@@ -74,6 +74,15 @@ class Component(object):
     def process(self, message: Message, **kwargs):
         pass
 
+    def process_batch(self, messages: List[Message], **kwargs):
+        """Process many messages at once, override it with a vectorized version."""
+        for message in messages:
+            self.process(message, **kwargs)
+
+    def metrics(self) -> Dict[Text, Any]:
+        """Runtime counters of the component (cache hit rates...), empty by default."""
+        return {}
+
     def persist(self, model_dir: Text) -> Optional[Dict[Text, Any]]:
         """Persist this component to disk for future loading."""
         pass
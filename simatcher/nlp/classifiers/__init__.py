@@ -1,2 +1,3 @@
 from .l2_classifier import L2Classifier
 from .langchain_classifier import LangchainClassifier
+from .exact_match_classifier import ExactMatchClassifier
@@ -0,0 +1,95 @@
+import threading
+from typing import (
+    Dict, Text, Any, List, Tuple, Optional
+)
+
+from simatcher.constants import (
+    CLASSIFIER_EXACT_MATCH, TEXT, POOL, TEXT_COL,
+    RANKING, INTENT, EXACT_MATCH, SCORE_METRIC
+)
+from simatcher.meta.message import Message
+from simatcher.common.cache import LRUCache
+from simatcher.common.stdlib import normalize_text
+from .classifier import Classifier
+
+
+class ExactMatchClassifier(Classifier):
+    """
+    Fast path ahead of the encoder, for queries repeating a configured utterance.
+    1, pool utterances are indexed by `normalize_text`, once per pool
+    2, a hit gets the matching records with a perfect score, marked by EXACT_MATCH
+    3, the featurizer and the vector classifier skip marked messages
+    The perfect score follows the metric the vector classifier puts in the pipeline context.
+    """
+    name = CLASSIFIER_EXACT_MATCH
+    provides = [INTENT, RANKING, EXACT_MATCH]
+    requires = [TEXT, POOL]
+    defaults = {
+        # number of pools whose utterance index is kept
+        'index_cache_size': 64,
+    }
+
+    def __init__(self, component_config: Dict[Text, Any] = None):
+        super(ExactMatchClassifier, self).__init__(component_config)
+        self.index_cache = LRUCache(max_size=self.component_config.get('index_cache_size'))
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        d = super(ExactMatchClassifier, self).__getstate__()
+        d['index_cache'] = LRUCache(max_size=self.index_cache.max_size)
+        d.pop('_lock', None)
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def perfect_score(metric: Optional[Text]) -> Tuple[Text, float]:
+        """0 distance for l2, the default, 1 similarity for cosine"""
+        if metric == 'cosine':
+            return 'scores', 1.
+        return 'distances', 0.
+
+    def train(self, training_data: Dict = None, cfg: Dict = None, **kwargs):
+        # real-time training, the pool is shared by requests and never modified,
+        # the cached entry keeps it alive so its id can not be reused
+        if training_data is None:
+            message = kwargs.get('message')
+            pool = message.get(POOL)
+            entry = self.index_cache.get(id(pool))
+            if entry is None or entry[0] is not pool:
+                text_col = message.get(TEXT_COL)
+                index: Dict[Text, List[int]] = {}
+                for row, record in enumerate(pool):
+                    index.setdefault(normalize_text(record.get(text_col, '')), []).append(row)
+                entry = (pool, index)
+                self.index_cache.set(id(pool), entry)
+            return entry[1]
+
+    def process(self, message: Message, **kwargs):
+        if not message.get(POOL):
+            return
+        rows = self.train(message=message).get(normalize_text(message.text))
+        with self._lock:
+            self.lookups += 1
+            if rows:
+                self.hits += 1
+        if not rows:
+            return
+        score_key, score = self.perfect_score(kwargs.get(SCORE_METRIC))
+        pool = message.get(POOL)
+        results = [dict({score_key: score, 'ann': row}, **pool[row]) for row in rows]
+        message.set(RANKING, results)
+        message.set(INTENT, results[0])
+        message.set(EXACT_MATCH, True)
+
+    def metrics(self) -> Dict[Text, Any]:
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.,
+            'index_cache': self.index_cache.stats(),
+        }
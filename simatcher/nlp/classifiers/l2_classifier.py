@@ -1,49 +1,264 @@
+import threading
+import weakref
 from typing import (
-    Dict, Text, Any, List, Tuple
+    Dict, Text, Any, List, Tuple, Optional
 )
 
-import pandas as pd
 import numpy as np
 from simatcher.constants import (
     CLASSIFIER_L2, TEXT_FEATURES, POOL_FEATURES,
-    RANKING, POOL, INTENT, POOL_DATA_FRAME
+    RANKING, INTENT, POOL_COLUMNS, POOL_FILTER, EXACT_MATCH, SCORE_METRIC
 )
 from simatcher.meta.message import Message
 from simatcher.algorithm.beta import SentenceFaiss
+from simatcher.common.cache import LRUCache
+from simatcher.common.stdlib import fingerprint
 from .classifier import Classifier
 
+# shared index sizes below it are never rebuilt, small indices are flat and cheap to grow
+SHARED_REBUILD_MIN = 1024
+
+
+class PoolView(object):
+    """Shared index mode, a pool as the set of its content ids in the shared index."""
+
+    def __init__(self, ids: np.ndarray, rows: Dict[int, List[int]], filter_key: Text):
+        self.ids = ids
+        self.rows = rows
+        self.filter_key = filter_key
+        # (weak reference to the index, its next label, id bitmap of `ids` in it),
+        # rebuilt when the shared index is replaced or grown
+        self.id_filter: Optional[Tuple[weakref.ref, int, np.ndarray]] = None
+
 
 class L2Classifier(Classifier):
     name = CLASSIFIER_L2
     provides = [INTENT, RANKING]
-    requires = [TEXT_FEATURES, POOL_FEATURES]
+    requires = [TEXT_FEATURES, POOL_FEATURES, POOL_COLUMNS]
+    defaults = {
+        # number of built indices kept, keyed by pool fingerprint
+        'index_cache_size': 64,
+        # flat (exact), ivf_flat, hnsw, ivf_pq, numpy, or auto: chosen by pool size and memory budget,
+        # approximate types trade recall for speed on large pools, opt in per pipeline
+        'index_type': 'flat',
+        'nlist': None,
+        'nprobe': 8,
+        'ef_search': 64,
+        'hnsw_m': 32,
+        'pq_m': None,
+        'memory_budget': None,
+        # l2: distances of unit vectors, cosine: similarity scores
+        'metric': 'l2',
+        # float32, float16 or int8 index vectors, see benchmark.compare_storage for the recall cost
+        'storage': 'float32',
+        # faiss openmp threads of the process, None keeps the faiss default
+        'num_threads': None,
+        # one index over the utterances of all filters, each pool searches its own id set
+        'shared_index': False,
+        # size of the ranking
+        'top_k': 5,
+        # hits past it are dropped before joining the pool records:
+        # largest distance for l2, smallest similarity for cosine, None keeps all
+        'threshold': None,
+    }
+    index_params = ['index_type', 'nlist', 'nprobe', 'ef_search', 'hnsw_m', 'pq_m', 'memory_budget', 'metric',
+                    'storage']
 
     def __init__(self, component_config: Dict[Text, Any] = None):
         super(L2Classifier, self).__init__(component_config)
+        if self.component_config.get('num_threads'):
+            SentenceFaiss.set_num_threads(self.component_config['num_threads'])
+        self._reset()
+
+    def _reset(self):
+        self.index_cache = LRUCache(max_size=self.component_config.get('index_cache_size'),
+                                    on_evict=self._on_evict)
+        self.shared_index: Optional[SentenceFaiss] = None
+        # shared index mode: size at the last build, live pool of each filter, live pools using each id
+        self._shared_size = 0
+        self._filter_pools: Dict[Text, Text] = {}
+        self._id_refs: Dict[int, int] = {}
+        self._shared_lock = threading.RLock()
+
+    def __getstate__(self):
+        d = super(L2Classifier, self).__getstate__()
+        # faiss indices are rebuilt on demand, never pickled
+        for key in ('index_cache', 'shared_index', '_shared_size', '_filter_pools', '_id_refs', '_shared_lock'):
+            d.pop(key, None)
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
 
     @classmethod
     def required_packages(cls) -> List[Text]:
         return ['faiss-cpu']
 
+    def provide_context(self) -> Optional[Dict[Text, Any]]:
+        # components ranking ahead of the index score their hits the same way
+        return {SCORE_METRIC: self.component_config.get('metric')}
+
+    @staticmethod
+    def pool_fingerprint(message: Message) -> Text:
+        columns = message.get(POOL_COLUMNS)
+        return fingerprint(message.get(POOL_FILTER), columns.text_col, columns.texts.tolist())
+
     def train(self, training_data: Dict = None, cfg: Dict = None, **kwargs):
-        # real-time training
+        # real-time training, reuse the index while the pool is unchanged
         if training_data is None:
-            sf = SentenceFaiss(kwargs.get('message').get(POOL_FEATURES))
-            sf.train()
+            message = kwargs.get('message')
+            key = self.pool_fingerprint(message)
+            sf = self.index_cache.get(key)
+            if sf is None:
+                sf = SentenceFaiss(message.get(POOL_FEATURES),
+                                   **{param: self.component_config.get(param) for param in self.index_params})
+                sf.train()
+                self.index_cache.set(key, sf)
             return sf
 
-    def process(self, message: Message, **kwargs):
-        model = self.train(message=message)
-        similarity = model.process(message.get(TEXT_FEATURES), 5)
-        similarity = pd.DataFrame({
-            'distances': similarity['distances'][0],
-            'ann': similarity['ann'][0]
-        })
-        pool_df = message.get(POOL_DATA_FRAME)
-        merge = pd.merge(similarity, pool_df, left_on='ann', right_index=True)
-        results = merge.to_dict('records')
+    def _pool_view(self, message: Message) -> PoolView:
+        """
+        Shared index mode, the id set of a pool:
+        1, every utterance gets a content id, equal utterances of all filters share a vector
+        2, ids missing from the shared index are added, a new pool of a filter releases its previous pool,
+           evicted pools are released too, ids left without any live pool are removed
+        3, the index is rebuilt once its size doubled or halved since its build,
+           the auto index type and the quantizer training follow the size
+        """
+        key = self.pool_fingerprint(message)
+        view = self.index_cache.get(key)
+        if view is not None:
+            return view
+        columns = message.get(POOL_COLUMNS)
+        ids = columns.content_ids()
+        unique, first = np.unique(ids, return_index=True)
+        vectors = np.asarray(message.get(POOL_FEATURES))[first]
+        rows: Dict[int, List[int]] = {}
+        for row, content_id in enumerate(ids.tolist()):
+            rows.setdefault(content_id, []).append(row)
+        view = PoolView(unique, rows, fingerprint(message.get(POOL_FILTER), columns.text_col))
+
+        with self._shared_lock:
+            if key in self.index_cache:
+                # built by a concurrent request meanwhile
+                return self.index_cache.get(key)
+            if self.shared_index is None:
+                self.shared_index = self._build_shared(unique, vectors)
+            else:
+                self.shared_index.add_missing(unique, vectors)
+            for content_id in unique.tolist():
+                self._id_refs[content_id] = self._id_refs.get(content_id, 0) + 1
+            previous = self._filter_pools.get(view.filter_key)
+            self._filter_pools[view.filter_key] = key
+            self.index_cache.set(key, view)
+            if previous is not None:
+                stale = self.index_cache.pop(previous)
+                if stale is not None:
+                    self._release(previous, stale)
+            self._resize()
+        return view
+
+    def _build_shared(self, ids: np.ndarray, vectors: np.ndarray) -> SentenceFaiss:
+        sf = SentenceFaiss(vectors, ids=ids, **{param: self.component_config.get(param) for param in self.index_params})
+        sf.train()
+        self._shared_size = len(sf)
+        return sf
+
+    def _resize(self):
+        size = len(self.shared_index)
+        built = max(self._shared_size, SHARED_REBUILD_MIN)
+        if size > 2 * built or (self._shared_size > SHARED_REBUILD_MIN and 2 * size < self._shared_size):
+            self.shared_index = self._build_shared(*self.shared_index.live_vectors())
+
+    def _on_evict(self, key: Text, value: Any):
+        if isinstance(value, PoolView):
+            self._release(key, value)
+
+    def _release(self, key: Text, view: PoolView):
+        """Drop a pool from the shared index, the index compacts itself past its `compact_ratio`."""
+        with self._shared_lock:
+            if self._filter_pools.get(view.filter_key) == key:
+                del self._filter_pools[view.filter_key]
+            dead = []
+            for content_id in view.ids.tolist():
+                refs = self._id_refs.pop(content_id) - 1
+                if refs:
+                    self._id_refs[content_id] = refs
+                else:
+                    dead.append(content_id)
+            if dead:
+                self.shared_index.remove(dead)
+                self._resize()
+
+    def _keep(self, ann: np.ndarray, scores: np.ndarray, higher_is_better: bool) -> np.ndarray:
+        """mask of the real hits passing the threshold, faiss pads missing hits with -1"""
+        keep = ann >= 0
+        threshold = self.component_config.get('threshold')
+        if threshold is not None:
+            keep &= scores >= threshold if higher_is_better else scores <= threshold
+        return keep
+
+    def _search(self, messages: List[Message]) -> Tuple[List, Text]:
+        """Pruned ann rows and scores of each message, all of them share one pool."""
+        top_k = self.component_config.get('top_k', 5)
+        # stacked copy of the query vectors, normalized in place by the index
+        queries = np.vstack([message.get(TEXT_FEATURES) for message in messages])
+        if not self.component_config.get('shared_index'):
+            model = self.train(message=messages[0])
+            hits = model.search_batch(queries, top_k, inplace=True)
+            keep = self._keep(hits['ann'], hits[model.score_key], model.higher_is_better)
+            return [(row['ann'][mask], row[model.score_key][mask]) for row, mask in zip(hits, keep)], \
+                model.score_key
+
+        view = self._pool_view(messages[0])
+        model = self.shared_index
+        id_filter = view.id_filter
+        if id_filter is None or id_filter[0]() is not model or id_filter[1] != model.next_label:
+            id_filter = view.id_filter = (weakref.ref(model), model.next_label, model.id_bitmap(view.ids))
+        hits = model.search_batch(queries, top_k, inplace=True, id_bitmap=id_filter[2])
+        keep = self._keep(hits['ann'], hits[model.score_key], model.higher_is_better)
+        results = []
+        for row, mask in zip(hits, keep):
+            # utterances repeated in the pool share the score of their content id
+            ann, scores = [], []
+            for content_id, score in zip(row['ann'][mask].tolist(), row[model.score_key][mask].tolist()):
+                for pool_row in view.rows.get(content_id, ()):
+                    ann.append(pool_row)
+                    scores.append(score)
+            results.append((ann[:top_k], scores[:top_k]))
+        return results, model.score_key
+
+    @staticmethod
+    def _rank(message: Message, ann: List[int], scores: List[float], score_key: Text):
+        results = message.get(POOL_COLUMNS).gather(ann, scores, score_key)
         message.set(RANKING, results)
-        message.set(INTENT, results[0])
+        message.set(INTENT, results[0] if results else None)
+
+    def process(self, message: Message, **kwargs):
+        if message.get(EXACT_MATCH):
+            return
+        hits, score_key = self._search([message])
+        self._rank(message, *hits[0], score_key)
+
+    def process_batch(self, messages: List[Message], **kwargs):
+        # one index lookup per distinct pool, one search call for all its queries
+        groups: Dict[int, List[Message]] = {}
+        for message in messages:
+            if message.get(EXACT_MATCH):
+                continue
+            groups.setdefault(id(message.get(POOL_FEATURES)), []).append(message)
+        for group in groups.values():
+            hits, score_key = self._search(group)
+            for message, (ann, scores) in zip(group, hits):
+                self._rank(message, ann, scores, score_key)
+
+    def metrics(self) -> Dict[Text, Any]:
+        metrics = {'index_cache': self.index_cache.stats()}
+        if self.shared_index is not None:
+            metrics['shared_index_size'] = len(self.shared_index)
+            metrics['shared_index_type'] = self.shared_index.index_type
+        return metrics
 
     def predict(self, x: List) -> Tuple[np.ndarray, np.ndarray]:
         pass
@@ -1,6 +1,9 @@
 import os
+import time
+import shutil
+import threading
 from typing import (
-    Dict, Text, Any, List,
+    Dict, Text, Any, List, Tuple, Optional, Set
 )
 
 from langchain.vectorstores import FAISS
@@ -10,6 +13,8 @@ from simatcher.constants import (
     POOL_FEATURES,
 )
 from simatcher.meta.message import Message
+from simatcher.common.stdlib import document_id
+from simatcher.common.io import write_to_file
 from simatcher.exceptions import MissingArgumentError
 from simatcher.log import logger
 from .classifier import Classifier
@@ -19,6 +24,11 @@ class LangchainClassifier(Classifier):
     name = CLASSIFIER_LANGCHAIN
     requires = [POOL_FEATURES]
     provides = [INTENT, RANKING]
+    # every save writes a new version directory, the pointer file names the current one
+    current_file = 'index.current'
+    versions_dir = 'versions'
+    # versions kept on disk, a reader may still be loading the previous one
+    keep_versions = 2
 
     def __init__(self, component_config: Dict[Text, Any] = None):
         super(LangchainClassifier, self).__init__(component_config)
@@ -27,9 +37,27 @@ class LangchainClassifier(Classifier):
         self.with_score = self.component_config.get('with_score', True)
         self.top_k = self.component_config.get('top_k', 4)
         self.score_threshold = self.component_config.get('score_threshold', 1)
+        # merge the new documents into the saved index instead of rebuilding it
+        self.incremental = self.component_config.get('incremental', False)
         self.encoder_model = None
         self.split_docs = None
         self.vectorstore_index = None
+        # (signature of the index files, loaded vectorstore), replaced as a whole on reload
+        self._vectorstore: Optional[Tuple[Tuple, FAISS]] = None
+        self._load_lock = threading.Lock()
+
+    def __getstate__(self):
+        d = super(LangchainClassifier, self).__getstate__()
+        # the index is saved by langchain in the knowledge base dir, not in the pickle
+        for key in ('vectorstore_index', '_vectorstore', '_load_lock'):
+            d.pop(key, None)
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.vectorstore_index = None
+        self._vectorstore = None
+        self._load_lock = threading.Lock()
 
     @classmethod
     def required_packages(cls) -> List[Text]:
@@ -45,9 +73,60 @@ class LangchainClassifier(Classifier):
         self.split_docs = training_data.get('split_docs')
         self.encoder_model = training_data.get(POOL_FEATURES)
 
+    def _index_signature(self) -> Tuple:
+        """mtime and size of an index saved in place, before versions"""
+        signature = []
+        for file_name in ('index.faiss', 'index.pkl'):
+            try:
+                stat = os.stat(os.path.join(self.knowledge_base_dir, file_name))
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _current_index(self) -> Tuple[Any, Text]:
+        """
+        (signature, directory) of the saved index.
+        The pointer file is swapped by one rename after its version is written,
+        the faiss index and the docstore read together always come from the same save.
+        """
+        try:
+            with open(os.path.join(self.knowledge_base_dir, self.current_file), encoding='utf-8') as f:
+                version = f.read().strip()
+            return version, os.path.join(self.knowledge_base_dir, self.versions_dir, version)
+        except FileNotFoundError:
+            return self._index_signature(), self.knowledge_base_dir
+
+    def index_nbytes(self) -> int:
+        """Size of the files of the current index, about the memory of its loaded vectorstore."""
+        _, index_dir = self._current_index()
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(index_dir) if entry.is_file())
+        except FileNotFoundError:
+            return 0
+
+    def vectorstore(self) -> FAISS:
+        """
+        Loaded once, reloaded when the index on disk changes.
+        Readers take no lock: the new store replaces the old one by a single assignment,
+        queries already running finish on the old one.
+        """
+        signature, index_dir = self._current_index()
+        current = self._vectorstore
+        if current is not None and current[0] == signature:
+            return current[1]
+        with self._load_lock:
+            current = self._vectorstore
+            if current is not None and current[0] == signature:
+                return current[1]
+            logger.info(f'Loading vectorstore of {self.knowledge_base_id}')
+            vectorstore = FAISS.load_local(index_dir, self.encoder_model, normalize_L2=True)
+            self._vectorstore = (signature, vectorstore)
+            return vectorstore
+
     def process(self, message: Message, **kwargs):
         logger.info(f'langchain classifier: {message.text}')
-        vectorstore_index = FAISS.load_local(self.knowledge_base_dir, self.encoder_model, normalize_L2=True)
+        vectorstore_index = self.vectorstore()
         results = vectorstore_index.similarity_search_with_score(message.text,
                                                                  k=self.top_k,
                                                                  score_threshold=self.score_threshold)
@@ -56,7 +135,79 @@ class LangchainClassifier(Classifier):
         if results:
             message.set(INTENT, results[0])
 
+    @staticmethod
+    def _chunk_ids(vectorstore: FAISS, doc_ids: Set[Text] = None, sources: Set[Text] = None) -> List[Text]:
+        """docstore ids of the chunks of these documents, a source is a doc_url or an intent (title)"""
+        chunk_ids = []
+        for chunk_id in vectorstore.index_to_docstore_id.values():
+            metadata = vectorstore.docstore.search(chunk_id).metadata
+            if (doc_ids and document_id(metadata) in doc_ids) or \
+                    (sources and (metadata.get('doc_url') in sources or metadata.get('intent') in sources)):
+                chunk_ids.append(chunk_id)
+        return chunk_ids
+
+    def _save(self, vectorstore: FAISS):
+        """
+        1, write the index and the docstore into a new version directory
+        2, point the current file to it, written aside then renamed
+        3, drop the versions past `keep_versions` and the index saved in place before versions
+        """
+        versions_dir = os.path.join(self.knowledge_base_dir, self.versions_dir)
+        version = f'{time.time_ns()}-{os.getpid()}'
+        vectorstore.save_local(os.path.join(versions_dir, version))
+        pointer = os.path.join(self.knowledge_base_dir, self.current_file)
+        write_to_file(f'{pointer}.tmp', version)
+        os.replace(f'{pointer}.tmp', pointer)
+
+        for old in sorted(os.listdir(versions_dir), reverse=True)[self.keep_versions:]:
+            if old != version:
+                shutil.rmtree(os.path.join(versions_dir, old), ignore_errors=True)
+        for file_name in ('index.faiss', 'index.pkl'):
+            try:
+                os.remove(os.path.join(self.knowledge_base_dir, file_name))
+            except FileNotFoundError:
+                pass
+
+    def has_saved_index(self) -> bool:
+        _, index_dir = self._current_index()
+        return os.path.isfile(os.path.join(index_dir, 'index.faiss'))
+
+    def _load_saved(self) -> Optional[FAISS]:
+        """private copy of the saved index for updates, queries keep using `vectorstore()`"""
+        if not self.has_saved_index():
+            return None
+        _, index_dir = self._current_index()
+        return FAISS.load_local(index_dir, self.encoder_model, normalize_L2=True)
+
+    def delete_documents(self, doc_ids: List[Text] = None, sources: List[Text] = None) -> int:
+        """Remove the chunks of these documents from the saved index, returns the removed count."""
+        vectorstore = self._load_saved()
+        if vectorstore is None:
+            return 0
+        chunk_ids = self._chunk_ids(vectorstore, set(doc_ids or []), set(sources or []))
+        if chunk_ids:
+            vectorstore.delete(chunk_ids)
+            self._save(vectorstore)
+        return len(chunk_ids)
+
     def persist(self, model_dir: Text) -> Dict[Text, Any]:
-        self.vectorstore_index = FAISS.from_documents(self.split_docs, self.encoder_model, normalize_L2=True)
-        self.vectorstore_index.save_local(self.knowledge_base_dir)
-        super().persist(model_dir)
+        """
+        full: index every chunk again
+        incremental: embed the new chunks only, chunks of re-sent documents are replaced
+        """
+        if not self.incremental:
+            vectorstore = FAISS.from_documents(self.split_docs, self.encoder_model, normalize_L2=True)
+        else:
+            vectorstore = self._load_saved()
+            if vectorstore is None:
+                # the new documents alone would make an index missing the rest of the archive
+                raise FileNotFoundError(f'No saved index of {self.knowledge_base_id} to update, train it in full')
+            replaced = self._chunk_ids(vectorstore, {document_id(doc.metadata) for doc in self.split_docs})
+            if replaced:
+                vectorstore.delete(replaced)
+            if self.split_docs:
+                vectorstore.add_documents(self.split_docs)
+            logger.info(f'Incremental index: {len(replaced)} chunks replaced, {len(self.split_docs)} added')
+        self.vectorstore_index = vectorstore
+        self._save(vectorstore)
+        return super().persist(model_dir)
@@ -1,6 +1,6 @@
 import os
 import re
-from typing import Dict, Text, Any, List, Optional, Iterable
+from typing import Dict, Text, Any, List, Optional, Iterable, Tuple
 from collections import deque
 
 from simatcher.common.io import write_json_to_file, read_json_file
@@ -31,8 +31,16 @@ class RegexRuleEntityExtractor(EntityExtractor):
         self.patterns = known_patterns or []
         self.stupid_patterns = ['.*', '^.+$', '']
 
-    def _preprocess_text(self, message: Message) -> Iterable:
-        if all([slot['pattern'] in self.stupid_patterns for slot in self.patterns]):
+    def _index_patterns(self, patterns: List[Dict[Text, Any]]) -> Tuple[Dict[Any, List[Dict]], bool]:
+        """slots grouped by intent id, and whether every pattern is a catch-all one"""
+        slots_by_usage = {}
+        for slot in patterns:
+            if slot.get('usage'):
+                slots_by_usage.setdefault(slot['usage'], []).append(slot)
+        return slots_by_usage, all([slot['pattern'] in self.stupid_patterns for slot in patterns])
+
+    def _preprocess_text(self, message: Message, all_stupid: bool) -> Iterable:
+        if all_stupid:
             clean_params = re.split(self.splitter, message.text)[1:]
         else:
             params = re.split(self.splitter, str(''.join([letter if ord(letter) < 128 else '?'
@@ -43,20 +51,21 @@ class RegexRuleEntityExtractor(EntityExtractor):
             ]
         return deque(clean_params)
 
-    def _extract_entities(self, message: Message) -> List[Dict[Text, Any]]:
+    def _extract_entities(self,
+                          message: Message,
+                          slots_by_usage: Dict[Any, List[Dict]],
+                          all_stupid: bool) -> List[Dict[Text, Any]]:
         """
         1, default value can not be used
         2, max len match method
         3, if contain special ${}, catch it by order
         4, add biz special function
+        slots are copied, the patterns may be shared by concurrent messages
         """
-        clean_params = self._preprocess_text(message)
-        if not self.case_sensitive:
-            flags = re.IGNORECASE
+        clean_params = self._preprocess_text(message, all_stupid)
+        flags = 0 if self.case_sensitive else re.IGNORECASE
 
-        entities = [
-            slot for slot in self.patterns if slot.get('usage') and slot['usage'] == message.get(INTENT).get('id')
-        ]
+        entities = [dict(slot) for slot in slots_by_usage.get(message.get(INTENT).get('id'), [])]
         for slot in entities:
             if slot[ENTITY_ATTRIBUTE_VALUE] in self.component_config.get('sys_pattern_value'):
                 continue
@@ -110,10 +119,30 @@ class RegexRuleEntityExtractor(EntityExtractor):
             }
         ]
         """
-        if not self.patterns:
-            self.train(message=message)
+        # runner is shared by requests, real-time patterns stay on the message
+        patterns = self.patterns or message.get(REGEX_FEATURES) or []
+        if not patterns:
+            logger.warning('No regex input')
+        self._set_entities(message, *self._index_patterns(patterns))
+
+    def process_batch(self, messages: List[Message], **kwargs):
+        # slots are grouped once per distinct pattern list, not once per message
+        indices = {}
+        for message in messages:
+            patterns = self.patterns or message.get(REGEX_FEATURES) or []
+            key = id(patterns)
+            if key not in indices:
+                if not patterns:
+                    logger.warning('No regex input')
+                indices[key] = self._index_patterns(patterns)
+            self._set_entities(message, *indices[key])
 
-        extracted_entities = self._extract_entities(message)
+    def _set_entities(self, message: Message, slots_by_usage: Dict[Any, List[Dict]], all_stupid: bool):
+        # no hit passed the classifier threshold, nothing to fill
+        if not message.get(INTENT):
+            message.set(ENTITIES, message.get(ENTITIES, []), add_to_output=True)
+            return
+        extracted_entities = self._extract_entities(message, slots_by_usage, all_stupid)
         extracted_entities = self._add_extractor_name(extracted_entities)
         message.set(ENTITIES, message.get(ENTITIES, []) + extracted_entities, add_to_output=True)
 
@@ -1,23 +1,38 @@
 import os
 from typing import Dict, Text, Any, List, Union
 
-import pandas as pd
 import numpy as np
 from torch import Tensor
-from sentence_transformers import SentenceTransformer
 
 from simatcher.constants import (
     FEATURIZER_BERT, TEXT_FEATURES, POOL_FEATURES,
-    TEXT, POOL, TEXT_COL, POOL_DATA_FRAME
+    TEXT, POOL, TEXT_COL, POOL_COLUMNS, EXACT_MATCH
 )
 from simatcher.meta.message import Message
+from simatcher.meta.pool import Pool
+from simatcher.common.cache import EmbeddingCache
+from simatcher.common.batching import MicroBatcher
+from simatcher.common.models import model_registry
 from .featurizer import Featurizer
 
 
 class BertFeaturizer(Featurizer):
     name = FEATURIZER_BERT
-    provides = [TEXT_FEATURES, POOL_FEATURES, POOL_DATA_FRAME]
+    provides = [TEXT_FEATURES, POOL_FEATURES, POOL_COLUMNS]
     requires = [TEXT, POOL]
+    defaults = {
+        'pre_model': 'all-MiniLM-L6-v2',
+        # torch device of the shared encoder, None lets sentence-transformers choose
+        'device': None,
+        # memory bound of the pool embedding cache, 0 disables it
+        'embedding_cache_bytes': 256 * 1024 * 1024,
+        # float32, float16 or int8 cached vectors, 2x / 4x more texts in the same bytes
+        'embedding_cache_dtype': 'float32',
+        # concurrent query encodes are coalesced into one forward pass, 0 disables it,
+        # a query alone is encoded at once, the wait is the idle gap tolerated between queued queries
+        'micro_batch_size': 32,
+        'micro_batch_wait_ms': 0,
+    }
 
     def __init__(self, component_config: Dict[Text, Any] = None):
         super(BertFeaturizer, self).__init__(component_config)
@@ -27,7 +42,27 @@ class BertFeaturizer(Featurizer):
                 data = f.read()
                 self.stop_words = frozenset(data.split('\n'))
         self.pool = None
+        self.pre_model = self.component_config.get('pre_model', 'all-MiniLM-L6-v2')
         self.encoder_model = None
+        cache_bytes = self.component_config.get('embedding_cache_bytes')
+        self.embedding_cache = EmbeddingCache(
+            cache_bytes, self.component_config.get('embedding_cache_dtype', 'float32')
+        ) if cache_bytes else None
+        batch_size = self.component_config.get('micro_batch_size')
+        self.query_batcher = MicroBatcher(
+            self._encode, batch_size,
+            self.component_config.get('micro_batch_wait_ms', 0) / 1000.
+        ) if batch_size and batch_size > 1 else None
+        self.train()
+
+    def __getstate__(self):
+        d = super(BertFeaturizer, self).__getstate__()
+        # weights are borrowed from the model registry again when loaded
+        d['encoder_model'] = None
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
         self.train()
 
     @classmethod
@@ -36,17 +71,61 @@ class BertFeaturizer(Featurizer):
 
     def train(self, training_data: Dict = None, cfg: Dict = None, **kwargs):
         # real-time training
-        if training_data is None:
-            pre_model = self.component_config.get('pre_model', 'all-MiniLM-L6-v2')
-            self.encoder_model = SentenceTransformer(f'./model/{pre_model}')
+        if training_data is None and self.encoder_model is None:
+            self.encoder_model = model_registry.borrow(self, f'./model/{self.pre_model}',
+                                                       self.component_config.get('device'))
+
+    def _encode(self, texts: Union[Text, List[Text]]) -> np.ndarray:
+        return self.encoder_model.encode(texts)
+
+    def _encode_pool(self, texts: List[Text]) -> np.ndarray:
+        if self.embedding_cache is None:
+            return self._encode(texts)
+        return self.embedding_cache.encode(self.pre_model, texts, self._encode)
+
+    def _encode_query(self, text: Text) -> np.ndarray:
+        if self.query_batcher is None:
+            return self._encode(text)
+        return self.query_batcher(text)
+
+    def _featurize_pool(self, message: Message):
+        columns = Pool(message.get(POOL), message.get(TEXT_COL))
+        pool: Union[List[Tensor], np.ndarray, Tensor] = self._encode_pool(columns.texts.tolist())
+        return pool, columns
 
     def process(self, message: Message, **kwargs):
+        if message.get(EXACT_MATCH):
+            return
         # matrix
-        pool: List[Dict] = message.get(POOL)
-        df = pd.DataFrame(pool)
-        pool: Union[List[Tensor], np.ndarray, Tensor] = self.encoder_model.encode(df[message.get(TEXT_COL)])
+        pool, columns = self._featurize_pool(message)
         message.set(POOL_FEATURES, pool)
-        message.set(POOL_DATA_FRAME, df)
+        message.set(POOL_COLUMNS, columns)
         # vector
-        text: Union[List[Tensor], np.ndarray, Tensor] = self.encoder_model.encode(message.text)
+        text: Union[List[Tensor], np.ndarray, Tensor] = self._encode_query(message.text)
         message.set(TEXT_FEATURES, text)
+
+    def process_batch(self, messages: List[Message], **kwargs):
+        messages = [message for message in messages if not message.get(EXACT_MATCH)]
+        if not messages:
+            return
+        # matrix, once per distinct pool
+        pools = {}
+        for message in messages:
+            key = id(message.get(POOL))
+            if key not in pools:
+                pools[key] = self._featurize_pool(message)
+            pool, columns = pools[key]
+            message.set(POOL_FEATURES, pool)
+            message.set(POOL_COLUMNS, columns)
+        # vectors, one forward pass for the whole batch
+        texts = self._encode([message.text for message in messages])
+        for message, text in zip(messages, texts):
+            message.set(TEXT_FEATURES, text)
+
+    def metrics(self) -> Dict[Text, Any]:
+        metrics = {}
+        if self.embedding_cache is not None:
+            metrics['embedding_cache'] = self.embedding_cache.stats()
+        if self.query_batcher is not None:
+            metrics['query_batcher'] = self.query_batcher.stats()
+        return metrics
@@ -1,15 +1,73 @@
-from typing import Dict, Text, Any, List
+import threading
+from typing import Dict, Text, Any, List, Optional
 
-from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.embeddings.base import Embeddings
 
 from simatcher.constants import (
     FEATURIZER_LANGCHAIN, POOL_FEATURES,
 )
 from simatcher.meta.message import Message
 from simatcher.log import logger
+from simatcher.common.models import model_registry
+from simatcher.common.cache import EmbeddingStore
+from simatcher.common.stdlib import fingerprint
 from .featurizer import Featurizer
 
 
+class SentenceEmbeddings(Embeddings):
+    """
+    langchain embeddings on a model borrowed from the process model registry,
+    same vectors as HuggingFaceEmbeddings. Pickled as its model path only,
+    every knowledge base loaded in a process shares one copy of the weights.
+    With `store_path`, document embeddings are read from / written to a persistent `EmbeddingStore`,
+    opened by the first `embed_documents`, a knowledge base loaded for search never opens it.
+    """
+
+    def __init__(self,
+                 model_name: Text,
+                 device: Optional[Text] = None,
+                 encode_kwargs: Dict = None,
+                 store_path: Optional[Text] = None):
+        self.model_name = model_name
+        self.device = device
+        self.encode_kwargs = encode_kwargs or {}
+        self.store_path = store_path
+        self.client = model_registry.borrow(self, model_name, device)
+        self._store: Optional[EmbeddingStore] = None
+        self._store_lock = threading.Lock()
+        # vectors depend on the model files and on the encode options, not on the model path alone
+        self.store_key = f'{model_name}:{fingerprint(self.client.revision, self.encode_kwargs)}'
+
+    def __getstate__(self):
+        return {'model_name': self.model_name, 'device': self.device,
+                'encode_kwargs': self.encode_kwargs, 'store_path': self.store_path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def store(self) -> Optional[EmbeddingStore]:
+        if self._store is None and self.store_path:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = EmbeddingStore(self.store_path)
+        return self._store
+
+    def _encode(self, texts: List[Text]):
+        return self.client.encode(texts, show_progress_bar=False, **self.encode_kwargs)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace('\n', ' ') for text in texts]
+        store = self.store
+        if store is None:
+            return self._encode(texts).tolist()
+        return store.encode(self.store_key, texts, self._encode).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # queries are not stored, they rarely repeat
+        return self._encode([text.replace('\n', ' ')])[0].tolist()
+
+
 class LangchainFeaturizer(Featurizer):
     name = FEATURIZER_LANGCHAIN
     provides = [POOL_FEATURES]
@@ -27,7 +85,9 @@ class LangchainFeaturizer(Featurizer):
         ]
 
     def train(self, training_data: Dict = None, cfg: Dict = None, **kwargs):
-        training_data[POOL_FEATURES] = HuggingFaceEmbeddings(model_name=f'./model/{self.pre_model}')
+        training_data[POOL_FEATURES] = SentenceEmbeddings(f'./model/{self.pre_model}',
+                                                          self.component_config.get('device'),
+                                                          store_path=self.component_config.get('embedding_store'))
 
     def process(self, message: Message, **kwargs):
         logger.info(f'langchain featurizer: {message.text}')
@@ -0,0 +1,175 @@
+import numpy as np
+import pytest
+
+from simatcher.algorithm import beta
+from simatcher.algorithm.beta import SentenceFaiss, INDEX_TYPES
+from simatcher.algorithm.benchmark import random_pool
+
+
+@pytest.mark.parametrize('index_type', INDEX_TYPES)
+def test_index_types_find_exact_duplicates(index_type):
+    pool = random_pool(2000, 32)
+    sf = SentenceFaiss(pool, index_type=index_type, nprobe=16, pq_m=8)
+    sf.train()
+    similarity = sf.process(pool[:10], 5)
+    assert similarity['ann'].shape == (10, 5)
+    if index_type != 'ivf_pq':
+        assert list(similarity['ann'][:, 0]) == list(range(10))
+
+
+def test_auto_index_type_by_pool_size_and_budget(monkeypatch):
+    assert SentenceFaiss.select_index_type(500, 768) == 'flat'
+    monkeypatch.setattr(beta, 'NUMPY_SEARCH_LIMIT', 1000)
+    assert SentenceFaiss.select_index_type(500, 768) == 'numpy'
+    assert SentenceFaiss.select_index_type(500, 768, storage='int8') == 'flat'
+    assert SentenceFaiss.select_index_type(50000, 768) == 'hnsw'
+    assert SentenceFaiss.select_index_type(50000, 768, memory_budget=1024 * 1024) == 'ivf_pq'
+    assert SentenceFaiss.select_index_type(2000000, 768) == 'ivf_flat'
+
+
+def test_evaluate_reports_recall():
+    pool = random_pool(1000, 16)
+    sf = SentenceFaiss(pool, index_type='hnsw')
+    sf.train()
+    report = sf.evaluate(pool[:20], pool, 5)
+    assert sf.vector_pool is None
+    assert 0.5 <= report['recall'] <= 1.0 and report['latency_ms'] >= 0
+
+
+def test_cosine_scores_without_mutating_caller_arrays():
+    pool = random_pool(200, 16).astype(np.float64)
+    original = pool.copy()
+    sf = SentenceFaiss(pool, metric='cosine')
+    sf.train()
+    query = pool[3]
+    similarity = sf.process(query, 3)
+    assert np.array_equal(pool, original)
+    assert similarity['ann'][0][0] == 3
+    assert abs(similarity['scores'][0][0] - 1.) < 1e-5
+    assert similarity['scores'][0][0] >= similarity['scores'][0][1]
+
+
+def test_inplace_queries_are_normalized_without_copy():
+    pool = random_pool(200, 16)
+    sf = SentenceFaiss(pool)
+    sf.train()
+    queries = pool[:4].copy()
+    unit = SentenceFaiss.as_unit_vectors(queries, inplace=True)
+    assert np.shares_memory(unit, queries)
+    assert np.allclose(np.linalg.norm(queries, axis=1), 1.)
+    assert np.array_equal(sf.search_batch(queries, 3, inplace=True)['ann'], sf.search_batch(pool[:4], 3)['ann'])
+
+
+def test_search_batch_returns_structured_hits():
+    pool = random_pool(300, 16)
+    sf = SentenceFaiss(pool)
+    sf.train()
+    hits = sf.search_batch(pool[:4], 3)
+    assert hits.shape == (4, 3)
+    assert list(hits['ann'][:, 0]) == [0, 1, 2, 3]
+    assert np.array_equal(hits['distances'], sf.process(pool[:4], 3)['distances'])
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'hnsw'])
+def test_incremental_add_remove_upsert_with_stable_ids(index_type):
+    pool = random_pool(500, 16)
+    ids = np.arange(500) * 10 + 7
+    sf = SentenceFaiss(pool[:400], index_type=index_type, ids=ids[:400], compact_ratio=0.5)
+    sf.train()
+    sf.add(ids[400:], pool[400:])
+    assert sf.search_batch(pool[450], 1)['ann'][0, 0] == ids[450]
+
+    assert sf.remove([ids[0], ids[1], 123456]) == 2
+    assert ids[0] not in sf.search_batch(pool[0], 5)['ann']
+    with pytest.raises(ValueError):
+        sf.add([ids[2]], pool[2:3])
+
+    sf.upsert([ids[2]], pool[3:4])
+    assert list(sf.search_batch(pool[3], 2)['ann'][0]) in ([ids[2], ids[3]], [ids[3], ids[2]])
+    assert len(sf) == 498
+
+    sf.remove(ids[10:300])
+    assert sf.faiss_index.ntotal == len(sf) == 208
+    assert sf.search_batch(pool[499], 1)['ann'][0, 0] == ids[499]
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'hnsw', 'ivf_flat'])
+def test_save_and_mmap_load(tmp_path, index_type):
+    pool = random_pool(1000, 16)
+    ids = np.arange(1000) + 100
+    sf = SentenceFaiss(pool, index_type=index_type, ids=ids)
+    sf.train()
+    sf.remove([100, 101])
+    expected = sf.search_batch(pool[:5], 3)
+    sf.save(str(tmp_path))
+
+    loaded = SentenceFaiss.load(str(tmp_path))
+    assert len(loaded) == 998
+    assert np.array_equal(loaded.search_batch(pool[:5], 3)['ann'], expected['ann'])
+    with pytest.raises(RuntimeError):
+        loaded.add([5000], pool[:1])
+
+    with pytest.raises(RuntimeError):
+        loaded.remove([102])
+    assert sorted(vars(loaded)) == sorted(vars(sf))
+
+    writable = SentenceFaiss.load(str(tmp_path), mmap=False)
+    writable.add([5000], pool[:1])
+    assert writable.search_batch(pool[0], 1)['ann'][0, 0] == 5000
+    assert writable.remove([102, 100]) == 1
+    writable.upsert([103], pool[500])
+    hits = writable.search_batch(pool[[2, 500]], 2)['ann']
+    assert 102 not in hits and 103 not in hits[0] and hits[1][0] in (103, 600)
+    assert len(writable) == 998
+
+
+def test_search_restricted_to_id_set():
+    pool = random_pool(600, 16)
+    sf = SentenceFaiss(pool[:400])
+    sf.train()
+    assert sf.add_missing(np.arange(300, 600), pool[300:]) == 200
+    tenant = np.arange(0, 600, 3)
+    hits = sf.search_batch(pool[:6], 4, ids=tenant)
+    assert set(hits['ann'].ravel()) <= set(tenant)
+    assert list(hits['ann'][::3, 0]) == [0, 3]
+    sf.remove([3])
+    assert 3 not in sf.search_batch(pool[3], 4, ids=tenant)['ann']
+
+
+@pytest.mark.parametrize('metric', ['l2', 'cosine'])
+def test_numpy_search_matches_faiss_flat(metric):
+    pool = random_pool(300, 16)
+    pool[7] = pool[3]
+    results = []
+    for index_type in ('flat', 'numpy'):
+        sf = SentenceFaiss(pool, index_type=index_type, metric=metric)
+        sf.train()
+        sf.remove([0])
+        before = sf.search_batch(pool[:8], 4)
+        # the cached storage view follows updates
+        sf.add([1000], pool[5])
+        results.append((before, sf.search_batch(pool[:8], 4), sf.search_batch(pool[:8], 4, ids=[1, 2, 3, 7])))
+    for expected, hits in zip(*results):
+        # exact duplicates tie, their order is up to the backend
+        assert np.array_equal(np.sort(expected['ann']), np.sort(hits['ann']))
+        assert np.allclose(expected[sf.score_key], hits[sf.score_key], atol=1e-5)
+
+
+@pytest.mark.parametrize('storage', ['float16', 'int8'])
+def test_compressed_storage(tmp_path, storage):
+    pool = random_pool(1000, 32)
+    sf = SentenceFaiss(pool, storage=storage)
+    sf.train()
+    assert sf.vector_pool is None
+    assert list(sf.search_batch(pool[:10], 1)['ann'][:, 0]) == list(range(10))
+    sf.save(str(tmp_path))
+    loaded = SentenceFaiss.load(str(tmp_path))
+    assert loaded.storage == storage
+    assert np.array_equal(loaded.search_batch(pool[:10], 3)['ann'], sf.search_batch(pool[:10], 3)['ann'])
+    # hnsw can not remove, compacting rebuilds it and the quantizer is trained again
+    hnsw = SentenceFaiss(pool, index_type='hnsw', storage=storage)
+    hnsw.train()
+    hnsw.compact_ratio = 0.
+    assert hnsw.remove(range(100)) == 100
+    assert len(hnsw) == 900 and hnsw.faiss_index.ntotal == 900
+    assert list(hnsw.search_batch(pool[100:110], 1)['ann'][:, 0]) == list(range(100, 110))
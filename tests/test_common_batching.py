@@ -0,0 +1,89 @@
+import time
+import threading
+
+import pytest
+
+from simatcher.common.batching import MicroBatcher
+
+
+def test_micro_batcher_lone_call_runs_inline():
+    batches = []
+
+    def batch_func(items):
+        batches.append((threading.current_thread().name, list(items)))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(batch_func, max_wait=0.05)
+    start = time.perf_counter()
+    assert batcher(21) == 42
+    assert time.perf_counter() - start < 0.02
+    assert batches == [(threading.current_thread().name, [21])]
+    assert batcher._thread is None
+
+
+def test_micro_batcher_coalesces_queued_items():
+    release = threading.Event()
+    batches = []
+
+    def batch_func(items):
+        batches.append(list(items))
+        release.wait(1)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(batch_func, max_batch_size=8)
+    # the first batch blocks the worker, the others queue up behind it
+    futures = [batcher.submit(i) for i in range(5)]
+    release.set()
+    assert [future.result(1) for future in futures] == [0, 2, 4, 6, 8]
+    assert len(batches) <= 2 and sum(map(len, batches)) == 5
+    assert batcher.stats()['items'] == 5
+    batcher.close()
+
+
+def test_micro_batcher_concurrent_callers_share_batches():
+    release = threading.Event()
+    batches = []
+
+    def batch_func(items):
+        batches.append(list(items))
+        release.wait(1)
+        return items
+
+    batcher = MicroBatcher(batch_func)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.update({i: batcher(i)})) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    while batcher._queue.qsize() + sum(map(len, batches)) < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == {i: i for i in range(4)}
+    assert len(batches) < 4
+    batcher.close()
+
+
+def test_micro_batcher_propagates_errors_to_every_waiter():
+    def batch_func(items):
+        raise RuntimeError('encoder down')
+
+    batcher = MicroBatcher(batch_func)
+    futures = [batcher.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(1)
+    with pytest.raises(RuntimeError):
+        batcher(0)
+    batcher.close()
+
+
+def test_micro_batcher_close_drains_then_restarts():
+    batcher = MicroBatcher(lambda items: [item + 1 for item in items])
+    futures = [batcher.submit(i) for i in range(3)]
+    thread = batcher._thread
+    batcher.close()
+    assert not thread.is_alive() and batcher._thread is None
+    assert [future.result(0) for future in futures] == [1, 2, 3]
+    assert batcher.submit(9).result(1) == 10
+    batcher.close()
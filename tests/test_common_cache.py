@@ -0,0 +1,94 @@
+import asyncio
+
+import numpy as np
+
+from simatcher.common.cache import LRUCache, EmbeddingCache, EmbeddingStore, AsyncTTLCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    evicted = []
+    cache = LRUCache(max_size=2, on_evict=lambda key, value: evicted.append((key, value)))
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert cache.stats()['evictions'] == 1
+    assert evicted == [('b', 2)]
+
+
+def test_lru_cache_bounded_by_bytes():
+    cache = LRUCache(max_bytes=100, sizeof=len)
+    cache.set('a', 'x' * 60)
+    cache.set('b', 'x' * 60)
+    assert len(cache) == 1 and cache.nbytes == 60
+
+
+def test_embedding_cache_encodes_only_new_texts():
+    calls = []
+
+    def encoder(texts):
+        calls.append(list(texts))
+        return np.array([[len(text), 1.] for text in texts], dtype=np.float32)
+
+    cache = EmbeddingCache()
+    first = cache.encode('model', ['QA1 重启', 'qa1  重启', 'abc'], encoder)
+    second = cache.encode('model', ['abc', 'abcd'], encoder)
+    assert calls == [['QA1 重启', 'abc'], ['abcd']]
+    assert first.shape == (3, 2) and np.array_equal(first[0], first[1])
+    assert np.array_equal(second[0], first[2])
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 4
+
+
+def test_embedding_cache_int8_storage():
+    rng = np.random.RandomState(0)
+    vectors = rng.randn(3, 64).astype(np.float32)
+    cache = EmbeddingCache(dtype='int8')
+    first = cache.encode('model', ['a', 'b', 'c'], lambda texts: vectors)
+    again = cache.encode('model', ['c', 'a'], lambda texts: None)
+    assert first.dtype == np.float32 and np.allclose(first, vectors, atol=0.05)
+    assert np.array_equal(again, first[[2, 0]])
+    assert cache.stats()['bytes'] == 3 * (64 + 64)
+
+
+def test_embedding_store_persists_and_encodes_only_new_texts(tmp_path):
+    rng = np.random.RandomState(0)
+    encoded = []
+
+    def encoder(texts):
+        encoded.extend(texts)
+        return rng.randn(len(texts), 8).astype(np.float32)
+
+    path = str(tmp_path / 'embeddings.sqlite3')
+    first = EmbeddingStore(path).encode('model', ['a', 'b', 'a'], encoder)
+    store = EmbeddingStore(path)
+    again = store.encode('model', ['b', 'c', 'a'], encoder)
+    other = store.encode('other', ['a'], encoder)
+    assert encoded == ['a', 'b', 'c', 'a']
+    assert np.array_equal(first[0], first[2])
+    assert np.array_equal(again[[0, 2]], first[[1, 0]])
+    assert not np.array_equal(other[0], first[0])
+    assert store.stats()['hits'] == 2
+
+
+def test_async_ttl_cache_single_flight_and_stale_refresh():
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return len(loads)
+
+    async def main():
+        cache = AsyncTTLCache(ttl=0.05, stale_ttl=10)
+        first = await asyncio.gather(*[cache.get('biz', loader) for _ in range(5)])
+        await asyncio.sleep(0.06)
+        stale = await cache.get('biz', loader)
+        await asyncio.sleep(0.02)
+        fresh = await cache.get('biz', loader)
+        return first, stale, fresh
+
+    first, stale, fresh = asyncio.run(main())
+    assert first == [1] * 5
+    assert stale == 1 and fresh == 2
+    assert len(loads) == 2
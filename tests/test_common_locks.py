@@ -0,0 +1,42 @@
+import threading
+
+from simatcher.common.locks import RWLock
+
+
+def test_rw_lock_readers_share_writer_waits():
+    lock = RWLock()
+    both_reading = threading.Barrier(2, timeout=1)
+    events = []
+
+    def reader():
+        with lock.read():
+            # both readers get here only if they hold the lock together
+            both_reading.wait()
+            events.append('read')
+
+    def writer():
+        with lock.write():
+            events.append('write')
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    writer_thread = threading.Thread(target=writer)
+    with lock.read():
+        writer_thread.start()
+        writer_thread.join(0.05)
+        assert writer_thread.is_alive()
+    writer_thread.join(1)
+    assert events == ['read', 'read', 'write']
+
+
+def test_rw_lock_writer_reenters():
+    lock = RWLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+    with lock.read():
+        pass
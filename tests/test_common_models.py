@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from simatcher.common import models
+from simatcher.common.models import SharedModel, model_revision
+
+
+def test_model_revision_follows_configs_and_weights(tmp_path):
+    os.makedirs(tmp_path / '1_Pooling')
+    (tmp_path / 'config.json').write_text('{"hidden_size": 768}')
+    (tmp_path / '1_Pooling' / 'config.json').write_text('{"pooling_mode_mean_tokens": true}')
+    weights = tmp_path / 'pytorch_model.bin'
+    weights.write_bytes(b'\0' * 16)
+    revision = model_revision(str(tmp_path))
+    assert model_revision(str(tmp_path)) == revision
+
+    (tmp_path / 'config.json').write_text('{"hidden_size": 1024}')
+    changed = model_revision(str(tmp_path))
+    assert changed != revision
+
+    weights.write_bytes(b'\0' * 32)
+    assert model_revision(str(tmp_path)) not in (revision, changed)
+
+
+class LockCheckingModel(object):
+    def __init__(self, path, device=None):
+        self.shared = None
+        self.calls = []
+
+    def parameters(self):
+        return []
+
+    def buffers(self):
+        return []
+
+    def encode(self, sentences, **kwargs):
+        # the shared model lock is held for this chunk only
+        assert self.shared.lock.locked()
+        self.calls.append(len(sentences))
+        return np.array([[len(sentence)] for sentence in sentences], dtype=np.float32)
+
+
+def test_long_encodes_take_the_lock_per_chunk(monkeypatch):
+    monkeypatch.setattr(models, 'SentenceTransformer', LockCheckingModel)
+    monkeypatch.setattr(models, 'ENCODE_CHUNK_SIZE', 4)
+    shared = SharedModel('missing-model-dir')
+    shared.model.shared = shared
+    sentences = ['x' * i for i in range(10)]
+    assert shared.encode(sentences).ravel().tolist() == list(range(10))
+    assert shared.model.calls == [4, 4, 2]
+    assert not shared.lock.locked()
+    assert shared.encode(['abc']).tolist() == [[3.]]
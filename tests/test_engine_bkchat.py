@@ -0,0 +1,33 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from simatcher.exceptions import ActionFailed
+from simatcher.engine.bk import bkchat
+
+
+def test_load_data_from_remote_timeout_is_504():
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.json_response({})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post('/slow', slow)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        bkchat._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(sock_read=0.05))
+        try:
+            await bkchat._load_data_from_remote('slow', host=f'http://127.0.0.1:{port}')
+        finally:
+            await bkchat.close_session()
+            await runner.cleanup()
+
+    with pytest.raises(ActionFailed) as e:
+        asyncio.run(main())
+    assert e.value.retcode == 504
@@ -0,0 +1,22 @@
+import pytest
+
+from simatcher.engine.base import Runner
+from simatcher.nlp.base import Component
+
+
+class Upper(Component):
+    name = 'upper'
+
+    def process_batch(self, messages, **kwargs):
+        for message in messages:
+            message.set('upper', message.text.upper())
+
+
+def test_parse_batch_chunks_and_handles_empty_input():
+    runner = Runner([Upper()], {})
+    assert runner.parse_batch([]) == []
+    assert runner.parse_batch([], batch_size=2) == []
+    messages = runner.parse_batch(['a', 'b', 'c'], batch_size=2)
+    assert [message.get('upper') for message in messages] == ['A', 'B', 'C']
+    with pytest.raises(ValueError):
+        runner.parse_batch(['a'], batch_size=0)
@@ -0,0 +1,65 @@
+import pytest
+
+from simatcher.constants import TEXT_FEATURES, POOL_FEATURES, POOL_COLUMNS, POOL_FILTER, INTENT, RANKING
+from simatcher.meta.message import Message
+from simatcher.meta.pool import Pool
+from simatcher.nlp.classifiers import l2_classifier
+from simatcher.nlp.classifiers.l2_classifier import L2Classifier
+from simatcher.algorithm.benchmark import random_pool
+
+VECTORS = random_pool(64, 16)
+
+
+def message(rows, pool_filter, query_row=None):
+    records = [{'id': row, 'utterance': f'utterance {row}'} for row in rows]
+    msg = Message(f'utterance {query_row}')
+    msg.set(POOL_COLUMNS, Pool(records, 'utterance'))
+    msg.set(POOL_FEATURES, VECTORS[rows])
+    msg.set(POOL_FILTER, pool_filter)
+    msg.set(TEXT_FEATURES, VECTORS[query_row if query_row is not None else rows[0]])
+    return msg
+
+
+def test_shared_index_releases_replaced_and_evicted_pools():
+    classifier = L2Classifier({'shared_index': True, 'index_cache_size': 2})
+    classifier.process(message(list(range(10)), {'biz': 'a'}))
+    assert len(classifier.shared_index) == 10
+
+    # a new pool of the same filter replaces the previous one
+    replaced = message(list(range(5)) + [40, 41], {'biz': 'a'}, query_row=41)
+    classifier.process(replaced)
+    assert len(classifier.shared_index) == 7
+    assert replaced.get(INTENT)['id'] == 41
+
+    classifier.process(message([0, 1, 20, 21], {'biz': 'b'}))
+    classifier.process(message([30, 31], {'biz': 'c'}))
+    # filter a evicted, only the utterances of b and c are left
+    assert len(classifier.shared_index) == 6
+    hits = message([30, 31], {'biz': 'c'}, query_row=0)
+    classifier.process(hits)
+    assert {result['id'] for result in hits.get(RANKING)} == {30, 31}
+
+
+def test_shared_index_rebuilt_when_size_doubles(monkeypatch):
+    monkeypatch.setattr(l2_classifier, 'SHARED_REBUILD_MIN', 4)
+    classifier = L2Classifier({'shared_index': True})
+    classifier.process(message(list(range(5)), {'biz': 'a'}))
+    first = classifier.shared_index
+    classifier.process(message(list(range(5, 20)), {'biz': 'b'}))
+    assert classifier.shared_index is not first and classifier._shared_size == 20
+    searched = message(list(range(5, 20)), {'biz': 'b'}, query_row=7)
+    classifier.process(searched)
+    assert searched.get(INTENT)['id'] == 7
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'numpy'])
+def test_pool_filter_follows_shared_index_growth(index_type):
+    classifier = L2Classifier({'shared_index': True, 'index_type': index_type})
+    first = message([0, 1, 2], {'biz': 'a'}, query_row=0)
+    classifier.process(first)
+    # the cached filter of pool a predates these ids, none of them may be searched for it
+    classifier.process(message(list(range(3, 60)), {'biz': 'b'}))
+    again = message([0, 1, 2], {'biz': 'a'}, query_row=0)
+    classifier.process(again)
+    assert [result['id'] for result in again.get(RANKING)] == [result['id'] for result in first.get(RANKING)]
+    assert {result['id'] for result in again.get(RANKING)} == {0, 1, 2}